@@ -0,0 +1,500 @@
+"""Offline load simulation for the queue and ready-check flow.
+
+Drives the real command handlers in bot_commands with fake Discord objects,
+so thousands of users can /keen, /unkeen, /p and /keeners across many
+lobbies, with ready checks answered by injected reaction events, without
+any network access.
+
+Usage:
+    python benchmarks/load_sim.py                   # Run the default randomized workload
+    python benchmarks/load_sim.py --script run.json # Replay a scripted workload
+    python benchmarks/load_sim.py --save-baseline   # Store the results as benchmarks/baseline.json
+    python benchmarks/load_sim.py --check           # Exit non-zero on regressions from the baseline (timings are only reported)
+    python benchmarks/load_sim.py --processes 4     # Split the lobbies across 4 shard-group processes
+
+A scripted workload is a JSON list of {"t": seconds, "op": "keen", "user": id, "lobby": n}.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+import bot_commands
+from lobbies import LobbyRegistry
+from outbound import OutboundPipeline
+from sharding import ShardPlan
+from spanner_store import SpannerStore
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+ACK_RATIO = 0.5  # A deferred command's acknowledgement p99 must stay under this share of its handler p99
+READY_SHARE_MARGIN = 0.2  # How far the share of ready checks that pass may fall below the baseline's
+READY_POST = "Everyone is ready!"
+TIMED_OUT_POST = "Users who readied up have been re-added to the queue."  # Posted once per ready check that timed out
+MENTION = re.compile(r"<@!?(\d+)>")
+
+COMMANDS = {
+    "keen": bot_commands.keen_command,
+    "unkeen": bot_commands.unkeen_command,
+    "p": bot_commands.potentially_keen_command,
+    "keeners": bot_commands.keeners_command,
+}
+
+
+class FakeMessage:
+    def __init__(self, message_id, channel, content):
+        self.id = message_id
+        self.channel = channel
+        self.content = content
+        self.reactions = []
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+
+class FakeChannel:
+    def __init__(self, client, channel_id, guild):
+        self.client = client
+        self.id = channel_id
+        self.guild = guild
+        self.messages = []
+
+    async def send(self, content):
+        if self.client.rest_latency:
+            await asyncio.sleep(self.client.rest_latency)
+        message = FakeMessage(self.client.next_id(), self, content)
+        self.messages.append(message)
+        self.client.on_message(message)
+        return message
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.mention = f"<@{user_id}>"
+        self.guild_permissions = SimpleNamespace(administrator=False)
+
+
+class FakeResponse:
+    def __init__(self):
+        self.done = False
+        self.acked_at = None  # perf_counter time of the first response or defer
+        self.messages = []
+
+    def is_done(self):
+        return self.done
+
+    def _ack(self):
+        if self.done:
+            raise RuntimeError("Interaction has already been responded to")
+        self.done = True
+        self.acked_at = time.perf_counter()
+
+    async def send_message(self, content, ephemeral=False):
+        self._ack()
+        self.messages.append(content)
+
+    async def defer(self, ephemeral=False, thinking=False):
+        self._ack()
+
+
+class FakeFollowup:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, content, ephemeral=False):
+        self.messages.append(content)
+
+
+class FakeInteraction:
+    def __init__(self, client, user, channel):
+        self.client = client
+        self.user = user
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild_id = channel.guild.id
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+
+class FakeClient:
+    """Stands in for discord.Client: a channel cache plus a hook on every sent message."""
+
+    def __init__(self, rest_latency=0.0):
+        self.rest_latency = rest_latency  # Simulated REST round trip for channel.send
+        self.channels = {}
+        self.on_message = lambda message: None
+        self._ids = 1000
+
+    def next_id(self):
+        self._ids += 1
+        return self._ids
+
+    def add_channel(self, guild_id, channel_id):
+        channel = FakeChannel(self, channel_id, SimpleNamespace(id=guild_id))
+        self.channels[channel_id] = channel
+        return channel
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+
+def random_workload(users=2000, lobbies=20, commands=5000, duration=2.0, seed=1):
+    """Randomized mix of commands from users who each stick to one home lobby."""
+    rng = random.Random(seed)
+    homes = {user_id: rng.randrange(lobbies) for user_id in range(1, users + 1)}
+    ops = ["keen"] * 5 + ["unkeen"] * 2 + ["p"] * 2 + ["keeners"]
+    workload = []
+    for _ in range(commands):
+        user_id = rng.randrange(1, users + 1)
+        workload.append({"t": rng.uniform(0, duration), "op": rng.choice(ops), "user": user_id, "lobby": homes[user_id]})
+    workload.sort(key=lambda event: event["t"])
+    return workload
+
+
+def lobby_guild(index):
+    """Snowflake-shaped guild ID for a simulated lobby, so lobbies spread across shards like real guilds."""
+    return (index + 1) << 22
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+
+    def at(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    return {"count": len(samples), "p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": samples[-1]}
+
+
+class LoadSimulation:
+    def __init__(self, workload, ready_rate=0.9, react_delay=0.05, ready_check_timeout=0.5,
+                 rest_latency=0.0, coalesce_window=0.01, channel_rate=1000.0, seed=1, data_dir=None,
+                 spanner_db_path=None):
+        self.workload = workload
+        self.ready_rate = ready_rate  # Chance a tagged user reacts to a ready check in time
+        self.react_delay = react_delay  # Max seconds before a simulated reaction arrives
+        self.ready_check_timeout = ready_check_timeout
+        self.rng = random.Random(seed)
+        self.client = FakeClient(rest_latency)
+        self.data_dir = data_dir
+        self.registry = LobbyRegistry(
+            spanner_path=os.path.join(data_dir, 'spanner_tracker.csv'),
+            conditional_path=os.path.join(data_dir, 'conditional_queue.json'),
+            spanner_db_path=spanner_db_path or os.path.join(data_dir, 'spanners.db'),
+            state_path=os.path.join(data_dir, 'lobbies.json'),
+            state_log_path=os.path.join(data_dir, 'lobbies.log'),
+        )
+        self.registry.outbound = OutboundPipeline(coalesce_window=coalesce_window, global_rate=channel_rate * 10,
+                                                  channel_rate=channel_rate, channel_burst=channel_rate)
+        self.client.on_message = self._on_message
+        self.latencies = defaultdict(list)  # {op: [seconds]}
+        self.ack_latencies = defaultdict(list)  # {op: [seconds until the interaction was acknowledged]}
+        self.loop_lag = []
+        self.errors = []
+        self.ready_checks = 0
+        self.ready_checks_passed = 0
+        self.ready_checks_timed_out = 0
+        self.max_queue_length = 0
+        self._background = set()
+
+    def _on_message(self, message):
+        # Posts may be coalesced, so count every outcome line in them
+        self.ready_checks_passed += message.content.count(READY_POST)
+        self.ready_checks_timed_out += message.content.count(TIMED_OUT_POST)
+        # Tagged users answer ready checks (and check-ins) through the reaction router
+        if "ALL ABOARD" in message.content:
+            self.ready_checks += 1
+        elif "still keen" not in message.content:
+            return
+        for user_id in MENTION.findall(message.content):
+            if self.rng.random() < self.ready_rate:
+                delay = self.rng.uniform(0, self.react_delay)
+                self._spawn(self._react(message.id, message.channel.id, int(user_id), "✅", delay))
+
+    async def _react(self, message_id, channel_id, user_id, emoji, delay):
+        await asyncio.sleep(delay)
+        payload = SimpleNamespace(message_id=message_id, channel_id=channel_id, user_id=user_id, emoji=emoji)
+        await self.registry.reaction_router.dispatch(payload)
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    def _lobby(self, index):
+        channel_id = 100 + index
+        if channel_id not in self.client.channels:
+            self.client.add_channel(lobby_guild(index), channel_id)
+        return self.client.channels[channel_id]
+
+    async def _run_command(self, event):
+        channel = self._lobby(event["lobby"])
+        interaction = FakeInteraction(self.client, FakeUser(event["user"]), channel)
+        queue_manager = self.registry.for_interaction(interaction)
+        queue_manager.READY_CHECK_TIMEOUT = self.ready_check_timeout
+        queue_manager.bot = self.client
+        start = time.perf_counter()
+        try:
+            await COMMANDS[event["op"]](interaction, queue_manager)
+        except Exception as e:
+            self.errors.append(f"{event['op']}: {e!r}")
+        self.latencies[event["op"]].append(time.perf_counter() - start)
+        if interaction.response.acked_at is not None:
+            self.ack_latencies[event["op"]].append(interaction.response.acked_at - start)
+        else:
+            self.errors.append(f"{event['op']}: interaction was never acknowledged")
+        self.max_queue_length = max(self.max_queue_length, len(queue_manager.keen_queue))
+
+    async def _monitor_loop_lag(self, interval=0.005):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(max(0.0, time.perf_counter() - start - interval))
+
+    async def run(self):
+        """Replay the workload and return a report dict."""
+        tracemalloc.start()
+        self.registry.bot = self.client
+        scheduler = self._spawn(self.registry.scheduler.run())
+        monitor = self._spawn(self._monitor_loop_lag())
+
+        start = time.perf_counter()
+        commands = []
+        for event in self.workload:
+            delay = event["t"] - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            commands.append(self._spawn(self._run_command(event)))
+        await asyncio.gather(*commands)
+        elapsed = time.perf_counter() - start
+
+        # Let queued channel messages drain before reading the counters
+        while self.registry.outbound.queue_depth():
+            await asyncio.sleep(0.01)
+        # Stop ready checks still waiting on votes so their last changes are logged before flushing
+        running = [task for lobby in self.registry for task in lobby.actor._tasks]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        await self.registry.spanners.store.flush()
+        await self.registry.state.flush()
+        self.registry.spanners.store.close()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        scheduler.cancel()
+        monitor.cancel()
+
+        outbound = self.registry.outbound.stats()
+        return {
+            "commands": len(self.workload),
+            "elapsed": elapsed,
+            "throughput": len(self.workload) / elapsed if elapsed else 0.0,
+            "latency": {op: percentiles(samples) for op, samples in sorted(self.latencies.items())},
+            "ack_latency": {op: percentiles(samples) for op, samples in sorted(self.ack_latencies.items())},
+            "loop_lag": percentiles(self.loop_lag),
+            "peak_memory_mb": peak / (1024 * 1024),
+            "lobbies": len(self.registry),
+            "ready_checks": self.ready_checks,
+            "ready_checks_passed": self.ready_checks_passed,
+            "ready_checks_timed_out": self.ready_checks_timed_out,
+            "max_queue_length": self.max_queue_length,
+            "spanners": sum(self.registry.spanners.leaderboard.counts.values()),
+            "posts": outbound["sent"],
+            "coalesced": outbound["coalesced"],
+            "errors": self.errors[:20],
+        }
+
+
+def run_simulation(workload, **options):
+    with tempfile.TemporaryDirectory() as data_dir:
+        return asyncio.run(LoadSimulation(workload, data_dir=data_dir, **options).run())
+
+
+def _run_group(workload, options, spanner_db_path):
+    return run_simulation(workload, spanner_db_path=spanner_db_path, **options)
+
+
+def run_sharded(workload, processes, shard_count=None, **options):
+    """Run the workload as `processes` shard groups, each in its own process with its own lobbies.
+
+    Lobbies are split by the shard Discord would route their guild to, as
+    launcher.py splits a real bot, and every group writes to one shared
+    spanners.db. Returns one merged report.
+    """
+    shard_count = shard_count or processes
+    plans = [ShardPlan(shard_count, processes, group) for group in range(processes)]
+    groups = [[event for event in workload if plan.owns_guild(lobby_guild(event["lobby"]))] for plan in plans]
+    with tempfile.TemporaryDirectory() as shared_dir:
+        spanner_db_path = os.path.join(shared_dir, 'spanners.db')
+        with ProcessPoolExecutor(processes) as pool:
+            reports = list(pool.map(_run_group, [group for group in groups if group], [options] * processes, [spanner_db_path] * processes))
+        store = SpannerStore(spanner_db_path)
+        stored = sum(total for _, _, total in store.totals())
+        store.close()
+    report = merge_reports(reports)
+    if stored != report["spanners"]:
+        report["errors"].append(f"shared store has {stored} spanners, groups recorded {report['spanners']}")
+    report["processes"] = len(reports)
+    return report
+
+
+def merge_reports(reports):
+    """Combine per-process reports: counts add up, timings take the slowest process."""
+    def worst(stats_list):
+        stats_list = [stats for stats in stats_list if stats.get("count")]
+        if not stats_list:
+            return {"count": 0}
+        merged = {key: max(stats[key] for stats in stats_list) for key in ("p50", "p95", "p99", "max")}
+        merged["count"] = sum(stats["count"] for stats in stats_list)
+        return merged
+
+    commands = sum(report["commands"] for report in reports)
+    elapsed = max(report["elapsed"] for report in reports)
+    ops = sorted({op for report in reports for op in report["latency"]})
+    return {
+        "commands": commands,
+        "elapsed": elapsed,
+        "throughput": commands / elapsed if elapsed else 0.0,
+        "latency": {op: worst([report["latency"].get(op, {}) for report in reports]) for op in ops},
+        "ack_latency": {op: worst([report["ack_latency"].get(op, {}) for report in reports]) for op in ops},
+        "loop_lag": worst([report["loop_lag"] for report in reports]),
+        "peak_memory_mb": max(report["peak_memory_mb"] for report in reports),
+        "lobbies": sum(report["lobbies"] for report in reports),
+        "ready_checks": sum(report["ready_checks"] for report in reports),
+        "ready_checks_passed": sum(report["ready_checks_passed"] for report in reports),
+        "ready_checks_timed_out": sum(report["ready_checks_timed_out"] for report in reports),
+        "max_queue_length": max(report["max_queue_length"] for report in reports),
+        "spanners": sum(report["spanners"] for report in reports),
+        "posts": sum(report["posts"] for report in reports),
+        "coalesced": sum(report["coalesced"] for report in reports),
+        "errors": [error for report in reports for error in report["errors"]][:20],
+    }
+
+
+def compare_to_baseline(report, baseline, tolerance=0.5):
+    """Return a list of regressions, judged only on results that don't depend on how fast the machine is.
+
+    Wall-clock timings vary too much between machines (and runs) to gate
+    on; timing_notes() reports them instead.
+    """
+    problems = []
+    if report["errors"]:
+        problems.append(f"{len(report['errors'])} command errors, e.g. {report['errors'][0]}")
+    share, base_share = ready_share(report), ready_share(baseline)
+    if base_share is not None and (share or 0.0) < base_share - READY_SHARE_MARGIN:
+        problems.append(f"{(share or 0.0):.0%} of ready checks passed vs baseline {base_share:.0%}")
+    if report["max_queue_length"] > baseline["max_queue_length"]:
+        problems.append(f"a queue reached {report['max_queue_length']} users vs baseline {baseline['max_queue_length']}")
+    for op, stats in report["ack_latency"].items():
+        # Deferred commands should be acknowledged long before their handler finishes
+        base, base_latency = baseline["ack_latency"].get(op), baseline["latency"].get(op)
+        if not (base and base.get("count") and base_latency and base["p99"] < base_latency["p99"] * ACK_RATIO):
+            continue
+        if stats["p99"] >= report["latency"][op]["p99"] * ACK_RATIO:
+            problems.append(f"/{op} acknowledgement p99 {stats['p99'] * 1000:.2f}ms is no longer well ahead of the handler p99 {report['latency'][op]['p99'] * 1000:.2f}ms")
+    if report["peak_memory_mb"] > baseline["peak_memory_mb"] * (1 + tolerance):
+        problems.append(f"peak memory {report['peak_memory_mb']:.1f}MiB vs baseline {baseline['peak_memory_mb']:.1f}MiB")
+    return problems
+
+
+def ready_share(report):
+    """Share of finished ready checks where everyone readied up, or None if none finished."""
+    finished = report.get("ready_checks_passed", 0) + report.get("ready_checks_timed_out", 0)
+    return report.get("ready_checks_passed", 0) / finished if finished else None
+
+
+def timing_notes(report, baseline, tolerance=0.5):
+    """Timings that moved past `tolerance` from the baseline. For information only."""
+    notes = []
+    if report["throughput"] < baseline["throughput"] * (1 - tolerance):
+        notes.append(f"throughput {report['throughput']:.0f}/s vs baseline {baseline['throughput']:.0f}/s")
+    for op, stats in report["latency"].items():
+        base = baseline["latency"].get(op)
+        if base and base.get("count") and stats["p95"] > base["p95"] * (1 + tolerance) + 0.005:
+            notes.append(f"/{op} p95 {stats['p95'] * 1000:.1f}ms vs baseline {base['p95'] * 1000:.1f}ms")
+    if report["loop_lag"].get("p99", 0) > baseline["loop_lag"].get("p99", 0) * (1 + tolerance) + 0.005:
+        notes.append(f"event-loop lag p99 {report['loop_lag']['p99'] * 1000:.1f}ms vs baseline {baseline['loop_lag']['p99'] * 1000:.1f}ms")
+    return notes
+
+
+def format_report(report):
+    lines = [
+        f"{report['commands']} commands in {report['elapsed']:.2f}s ({report['throughput']:.0f}/s) across {report['lobbies']} lobbies"
+        + (f" in {report['processes']} processes" if report.get("processes") else ""),
+        f"ready checks: {report['ready_checks']} ({report['ready_checks_passed']} ready, {report['ready_checks_timed_out']} timed out), spanners: {report['spanners']}, posts: {report['posts']} ({report['coalesced']} coalesced)",
+        f"max queue length: {report['max_queue_length']}, peak memory: {report['peak_memory_mb']:.1f}MiB",
+        f"event-loop lag p99: {report['loop_lag'].get('p99', 0) * 1000:.1f}ms, max: {report['loop_lag'].get('max', 0) * 1000:.1f}ms",
+    ]
+    for op, stats in report["latency"].items():
+        ack = report["ack_latency"].get(op, {})
+        lines.append(
+            f"/{op}: n={stats['count']} p50={stats['p50'] * 1000:.2f}ms p95={stats['p95'] * 1000:.2f}ms p99={stats['p99'] * 1000:.2f}ms"
+            f" (acknowledged p99={ack.get('p99', 0) * 1000:.2f}ms)"
+        )
+    if report["errors"]:
+        lines.append(f"errors: {report['errors']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--lobbies", type=int, default=20)
+    parser.add_argument("--commands", type=int, default=5000)
+    parser.add_argument("--duration", type=float, default=2.0, help="Seconds the commands are spread over")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--script", help="JSON workload to replay instead of a random one")
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="Simulated seconds per channel.send")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="Compare against the saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--processes", type=int, default=1, help="Split the lobbies across this many shard-group processes")
+    parser.add_argument("--shards", type=int, help="Shard count for --processes (default: one per process)")
+    parser.add_argument("--verbose", action="store_true", help="Keep the bot's INFO logging")
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    if args.script:
+        with open(args.script, 'r', encoding='utf-8') as f:
+            workload = json.load(f)
+    else:
+        workload = random_workload(args.users, args.lobbies, args.commands, args.duration, args.seed)
+
+    if args.processes > 1:
+        report = run_sharded(workload, args.processes, args.shards, rest_latency=args.rest_latency, seed=args.seed)
+    else:
+        report = run_simulation(workload, rest_latency=args.rest_latency, seed=args.seed)
+    print(format_report(report))
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {BASELINE_PATH}")
+    if args.check:
+        with open(BASELINE_PATH, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        for note in timing_notes(report, baseline, args.tolerance):
+            print(f"NOTE (not checked, timings depend on the machine): {note}")
+        problems = compare_to_baseline(report, baseline, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,16 @@
 import discord
 from discord.ext import commands
-import asyncio
 from dotenv import load_dotenv
+import asyncio
 import os
-from queue_manager import QueueManager
-import bot_commands
 import time
-from collections import Counter
+from lobbies import LobbyRegistry
+from command_sync import sync_commands
+import bot_commands
+from metrics import metrics
+from gateway import EntityCache, cache_report, client_options, log_cache_report
+from sharding import LocalCoordinator, ShardPlan
+from outbound import GLOBAL_RATE, TokenBucket
 from discord import app_commands  # Import app_commands
 import logging
 
@@ -16,149 +20,217 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Load environment variables from .env file
 load_dotenv("token.env")
 TOKEN = os.getenv("TOKEN")
-PRIVATE_CHANNEL_ID = int(os.getenv("PRIVATE_CHANNEL_ID"))  # Load private channel ID from .env
+PRIVATE_CHANNEL_ID = int(os.getenv("PRIVATE_CHANNEL_ID", 0)) or None  # Optional notification channel from .env
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "").lower() in ("1", "true", "yes")  # Sync on startup even if unchanged
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0)) or None  # Serve Prometheus metrics on 127.0.0.1:<port>
+METRICS_FILE = os.getenv("METRICS_FILE")  # Or write them to this file every METRICS_INTERVAL seconds
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", 15))
+LEAN_GATEWAY = os.getenv("LEAN_GATEWAY", "").lower() in ("1", "true", "yes")  # Minimal intents, no message or member cache
+MESSAGE_CACHE_SIZE = int(os.getenv("MESSAGE_CACHE_SIZE")) if os.getenv("MESSAGE_CACHE_SIZE") else None  # 0 disables it
+LOG_MESSAGE_CONTENT = os.getenv("LOG_MESSAGE_CONTENT", "true").lower() not in ("0", "false", "no")  # Log every message the bot sends
+AUTO_SHARD = os.getenv("AUTO_SHARD", "").lower() in ("1", "true", "yes")  # One process, as many shards as Discord recommends
+SHARDS = ShardPlan.from_env()  # SHARD_COUNT/SHARD_GROUPS/SHARD_GROUP, set by launcher.py for a process per shard group
+SPANNER_REFRESH_INTERVAL = float(os.getenv("SPANNER_REFRESH_INTERVAL", 60))  # With shard groups, how often to re-read shared spanner totals
 
 if not TOKEN:
     logging.error("Error: TOKEN environment variable is not set.")
     exit(1)
 
-# Enable necessary bot intents
-intents = discord.Intents.default()
-intents.message_content = True
+class TimedCommandTree(app_commands.CommandTree):
+    """Command tree that records how long every slash command takes."""
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        interaction.extras["started"] = time.perf_counter()
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error):
+        record_command_time(interaction, "error")
+        await super().on_error(interaction, error)
+
+def record_command_time(interaction, outcome):
+    started = interaction.extras.get("started")
+    if started is not None and interaction.command is not None:
+        metrics.observe("spanner_command_seconds", time.perf_counter() - started, command=interaction.command.name, outcome=outcome)
+
+BotClass = commands.AutoShardedBot if SHARDS.sharded or AUTO_SHARD else commands.Bot
+
+class SpannerBot(BotClass):
+    """Spaces out IDENTIFYs across processes when shard groups share the machine."""
+
+    coordinator = LocalCoordinator() if SHARDS.group_count > 1 else None
+
+    async def before_identify_hook(self, shard_id, *, initial=False):
+        if self.coordinator is None:
+            await super().before_identify_hook(shard_id, initial=initial)
+        else:
+            await self.coordinator.identify(shard_id)
+
+# Initialize bot with command prefix, intents and cache limits
+bot = SpannerBot(command_prefix='!', tree_cls=TimedCommandTree, **client_options(LEAN_GATEWAY, MESSAGE_CACHE_SIZE), **(SHARDS.bot_options() if SHARDS.sharded else {}))
 
-# Initialize bot with command prefix and intents
-bot = commands.Bot(command_prefix='!', intents=intents)
+# Channels looked up on demand rather than from the full client caches (used for every lookup via resolve_channel below)
+entities = EntityCache(bot)
 
-# Initialize QueueManager
-queue_manager = QueueManager()
+# One lobby (QueueManager) per guild channel, created when first used
+# With shard groups, each process only has its own shards' lobbies (in per-group files); spanners.db is shared by all of them
+lobbies = LobbyRegistry(
+    private_channel_id=PRIVATE_CHANNEL_ID,
+    shards=SHARDS,
+    spanner_refresh_interval=SPANNER_REFRESH_INTERVAL if SHARDS.group_count > 1 else None,
+)
+lobbies.outbound.log_content = LOG_MESSAGE_CONTENT
+lobbies.outbound.resolve_channel = entities.channel
+# The global rate limit is per bot token, so shard-group processes split it between them
+global_rate = GLOBAL_RATE / SHARDS.group_count
+lobbies.outbound.global_bucket = TokenBucket(rate=global_rate, capacity=global_rate)
+
+@bot.event
+async def setup_hook():
+    # Runs once per process before the first connect, so gateway reconnects skip all of this
+    lobbies.spanners.load(import_csv=SHARDS.is_primary)
+
+    # Sync commands, but only when they've changed since the last successful sync (once per bot, not per shard group)
+    if SHARDS.is_primary:
+        try:
+            await sync_commands(bot, force=FORCE_COMMAND_SYNC)
+        except Exception as e:
+            logging.error(f"Failed to sync commands: {e}")
+
+    # Start the timeout checker
+    bot.loop.create_task(lobbies.run(bot))
+
+    # Metrics: event-loop lag always, plus an HTTP endpoint and/or file if configured
+    lobbies.register_metrics(metrics)
+    metrics.gauge("spanner_cache_size", lambda: {(("cache", name),): value for name, value in cache_report(bot, entities).items()}, "Client cache sizes (peak_rss_mb is in MiB)")
+    bot.loop.create_task(metrics.monitor_loop_lag())
+    if METRICS_PORT:
+        bot.loop.create_task(metrics.serve(port=METRICS_PORT + SHARDS.group_index))  # One port per shard group
+    if METRICS_FILE:
+        bot.loop.create_task(metrics.write_periodically(METRICS_FILE, METRICS_INTERVAL))
+
+def resume_lobby(queue_manager):
+    """Reschedule a restored lobby's conditional keens and settle its ready check."""
+    bot_commands.restore_conditional_keens(bot, queue_manager)
+    queue_manager.actor.spawn(bot_commands.resume_lobby(bot, queue_manager))
+
+# Lobbies another shard group hands over after a re-shard, if it started after this one
+lobbies.on_handover = resume_lobby
 
 @bot.event
 async def on_ready():
     logging.info(f'Logged in as {bot.user}')
-    queue_manager.load_spanner_tracker()
-    
-    # Dynamically set YOUR_CHANNEL_ID
-    await queue_manager.set_channel_id(bot)
-    
-    # Sync commands
-    try:
-        await bot.tree.sync()
-        logging.info("Commands synced globally.")
-    except Exception as e:
-        logging.error(f"Failed to sync commands: {e}")
-    
-    # Start the timeout checker
-    bot.loop.create_task(queue_manager.check_queue_timeouts(bot))
+    log_cache_report(bot, entities)
+    if lobbies.loaded:
+        return  # Reconnected; lobby state is already in memory
+
+    # Pick up queues and conditional keens from before a restart (needs the channel cache, so not in setup_hook)
+    lobbies.load(bot)
+    for queue_manager in lobbies:
+        resume_lobby(queue_manager)
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    record_command_time(interaction, "ok")
+
+@bot.event
+async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
+    # Raw events still fire for uncached messages, e.g. check-ins sent before a restart
+    await lobbies.reaction_router.dispatch(payload)
 
 @bot.tree.command(name="keen", description="Join the queue, optionally with a delay in minutes (up to 6 hours)")
 @app_commands.describe(minutes="Optional: Delay in minutes before asking if you're still keen (1-360).")
 async def keen(interaction: discord.Interaction, minutes: app_commands.Range[int, 1, 360] = None):
-    user = interaction.user.mention
-    user_id = interaction.user.id
-
-    # Check if the user is already in the queue
-    if user in queue_manager.keen_queue:
-        await interaction.response.send_message(f"{user}, you're already in the queue!", ephemeral=True)
-        return
-
-    # Handle conditional keen (with minutes)
-    if minutes is not None:
-        # Add the user to the conditional queue
-        queue_manager.conditional_queue[user] = time.time() + (minutes * 60)
-        logging.info(f"Added {user} to conditional queue. Will check back in {minutes} minutes.")
-        await interaction.response.send_message(f"{user}, you'll be asked if you're keen in {minutes} minutes.", ephemeral=False)
-
-        # Schedule the conditional check
-        await asyncio.sleep(minutes * 60)
-
-        # Check if the user is still in the conditional queue (they might have left manually)
-        if user in queue_manager.conditional_queue:
-            logging.info(f"Checking if {user} is still keen...")
-            # Send the message to the private channel and get the message object
-            message = await queue_manager.send_message_to_channel(bot, queue_manager.YOUR_CHANNEL_ID, f"{user}, are you still keen? React with ✅ to join the queue or ❌ to decline.")
-            
-            if message:  # Ensure the message was sent successfully
-                await message.add_reaction("✅")
-                await message.add_reaction("❌")
-
-                def check(reaction, user):
-                    return (
-                        reaction.emoji in ["✅", "❌"]  # Correct emoji
-                        and user.mention in queue_manager.conditional_queue  # Correct user
-                        and reaction.message.id == message.id  # Correct message
-                    )
-
-                try:
-                    # Wait for the user's reaction with a 5-minute timeout
-                    reaction, _ = await bot.wait_for('reaction_add', timeout=300.0, check=check)
-                    if reaction.emoji == "✅":
-                        # Add the user to the queue
-                        await bot_commands.make_keen(interaction, queue_manager)
-                        await interaction.followup.send(f"{user} is still keen and has been added to the queue!", ephemeral=False)
-                    else:
-                        # Mark the user as a spanner
-                        queue_manager.spanner_tracker.append((user_id, user))
-                        queue_manager.save_spanner_tracker()
-                        await interaction.followup.send(f"{user} declined and has been marked as a spanner! :wrench:", ephemeral=False)
-                except asyncio.TimeoutError:
-                    # Mark the user as a spanner if they don't respond within 5 minutes
-                    queue_manager.spanner_tracker.append((user_id, user))
-                    queue_manager.save_spanner_tracker()
-                    await interaction.followup.send(f"{user} spannered by not responding in time! :wrench:", ephemeral=False)
-                finally:
-                    # Remove the user from the conditional queue
-                    del queue_manager.conditional_queue[user]
-            else:
-                logging.error(f"Failed to send message to channel {queue_manager.YOUR_CHANNEL_ID}.")
-    else:
-        # Regular keen behavior (no delay)
-        await bot_commands.make_keen(interaction, queue_manager)
+    await bot_commands.keen_command(interaction, lobbies.for_interaction(interaction), minutes)
 
 @bot.tree.command(name="unkeen", description="Leave the queue")
 async def unkeen(interaction: discord.Interaction):
-    user = interaction.user.mention
-    user_id = interaction.user.id
-
-    if user_id in queue_manager.unkeen_cooldown:
-        remaining = queue_manager.unkeen_cooldown[user_id] - time.time()
-        if remaining > 0:
-            minutes, seconds = divmod(remaining, 60)
-            await interaction.response.send_message(f"You're on cooldown! Try again in {int(minutes)}m {int(seconds)}s.", ephemeral=True)
-            return
-
-    if user in queue_manager.keen_queue:
-        del queue_manager.keen_queue[user]
-        await interaction.response.send_message(f"{user} has been removed from the queue.", ephemeral=True)
-        if queue_manager.YOUR_CHANNEL_ID is not None:
-            await queue_manager.send_message_to_channel(bot, queue_manager.YOUR_CHANNEL_ID, f"{user} is spannering :wrench:")
-        else:
-            logging.error("YOUR_CHANNEL_ID not set. Cannot send spanner message.")
-        queue_manager.unkeen_cooldown[user_id] = time.time() + 300
-        queue_manager.spanner_tracker.append((user_id, user))
-        queue_manager.save_spanner_tracker()
-    else:
-        await interaction.response.send_message(f"{user}, you're not in the queue!", ephemeral=True)
+    await bot_commands.unkeen_command(interaction, lobbies.for_interaction(interaction))
 
 @bot.tree.command(name="keeners", description="Show the current queue")
 async def keeners(interaction: discord.Interaction):
-    if queue_manager.keen_queue or queue_manager.potential_queue:
-        queue_list = "\n".join(f"{i+1}. {user}" for i, (user, _) in enumerate(queue_manager.keen_queue.items()))
-        potential_list = "\n".join(f"Potential: {user}" for user in queue_manager.potential_queue)
-        await interaction.response.send_message(f"Current queue:\n{queue_list}\n\nPotential keens:\n{potential_list}", ephemeral=True)
-    else:
-        await interaction.response.send_message("The queue is currently empty.", ephemeral=True)
+    await bot_commands.keeners_command(interaction, lobbies.for_interaction(interaction))
+
+SPANNERS_PAGE_SIZE = 20  # Keeps each page well under Discord's 2000-character limit
 
 @bot.tree.command(name="spanners", description="Show the list of spannerers and their counts :wrench:")
-async def spanners(interaction: discord.Interaction):
-    if not queue_manager.spanner_tracker:
+@app_commands.describe(page="Optional: Which page of the leaderboard to show.", period="Optional: All time (default), a recent window, or a score where old spanners fade.")
+@app_commands.choices(period=[
+    app_commands.Choice(name="All time", value="all"),
+    app_commands.Choice(name="Last 7 days", value="7"),
+    app_commands.Choice(name="Last 30 days", value="30"),
+    app_commands.Choice(name="Decayed score", value="decayed"),
+])
+async def spanners(interaction: discord.Interaction, page: app_commands.Range[int, 1, None] = 1, period: str = "all"):
+    if period != "all":
+        await recent_spanners(interaction, page, period)
+        return
+
+    leaderboard = lobbies.spanners.leaderboard
+    if not len(leaderboard):
         await interaction.response.send_message("No spanners have been recorded yet.", ephemeral=True)
         return
 
-    user_mentions = [mention for _, mention in queue_manager.spanner_tracker]
-    spanner_counts = Counter(user_mentions)
+    total_pages = (len(leaderboard) + SPANNERS_PAGE_SIZE - 1) // SPANNERS_PAGE_SIZE
+    page = min(page, total_pages)
+    entries = leaderboard.top(SPANNERS_PAGE_SIZE, offset=(page - 1) * SPANNERS_PAGE_SIZE)
+    spanner_list = "\n".join(f"{rank}. {mention}: {count} 🔧" for rank, _, mention, count in entries)
 
-    spanner_list = "\n".join(f"{mention}: {count} 🔧" for mention, count in spanner_counts.items())
-    await interaction.response.send_message(f"Spanner Tracker:\n{spanner_list}", ephemeral=True)
+    user_rank = leaderboard.rank(interaction.user.id)
+    if user_rank is not None:
+        footer = f"You're #{user_rank} with {leaderboard.count(interaction.user.id)} 🔧"
+    else:
+        footer = "You haven't spannered yet!"
+    await interaction.response.send_message(f"Spanner Tracker (page {page}/{total_pages}):\n{spanner_list}\n\n{footer}", ephemeral=True)
+
+async def recent_spanners(interaction: discord.Interaction, page, period):
+    # Windowed and decayed boards are queried from the spanner store off the event loop
+    await interaction.response.defer(ephemeral=True)
+    store = lobbies.spanners.store
+    offset = (page - 1) * SPANNERS_PAGE_SIZE
+    if period == "decayed":
+        rows = await store.fetch(store.decayed_scores, None, SPANNERS_PAGE_SIZE, offset)
+        title = f"Spanner scores, halving every {store.half_life / 86400:g} days"
+        lines = [f"{offset + i + 1}. {mention}: {score:.2f} 🔧" for i, (_, mention, score) in enumerate(rows)]
+    else:
+        rows = await store.fetch(store.counts_since, time.time() - int(period) * 86400, None, SPANNERS_PAGE_SIZE, offset)
+        title = f"Spanners in the last {period} days"
+        lines = [f"{offset + i + 1}. {mention}: {count} 🔧" for i, (_, mention, count) in enumerate(rows)]
+    if not lines:
+        await interaction.followup.send("No spanners on this page for that period.", ephemeral=True)
+        return
+    await interaction.followup.send(f"{title} (page {page}):\n" + "\n".join(lines), ephemeral=True)
+
+SPANNER_REASONS = {
+    "unkeen": "used /unkeen",
+    "ready_check_timeout": "didn't ready up",
+    "conditional_decline": "declined a check-in",
+    "conditional_no_response": "didn't answer a check-in",
+    "imported": "before history was kept",
+}
+
+@bot.tree.command(name="spannerhistory", description="Show your (or someone's) recent spanners :wrench:")
+@app_commands.describe(user="Optional: Whose history to show.")
+async def spannerhistory(interaction: discord.Interaction, user: discord.User = None):
+    await interaction.response.defer(ephemeral=True)
+    user = user or interaction.user
+    store = lobbies.spanners.store
+    now = time.time()
+    events = await store.fetch(store.history, user.id, 10)
+    if not events:
+        await interaction.followup.send(f"{user.mention} hasn't spannered yet!", ephemeral=True)
+        return
+    week = await asyncio.to_thread(store.count_since, user.id, now - 7 * 86400)
+    month = await asyncio.to_thread(store.count_since, user.id, now - 30 * 86400)
+    score = await asyncio.to_thread(store.decayed_score, user.id, now)
+    lines = [
+        f"- {f'<t:{int(created_at)}:R>' if created_at else 'a while ago'}: {SPANNER_REASONS.get(reason, reason)}"
+        for created_at, reason, _ in events
+    ]
+    await interaction.followup.send(
+        f"{user.mention}: {lobbies.spanners.leaderboard.count(user.id)} 🔧 all time, {week} this week, {month} in 30 days, score {score:.2f}\n"
+        + "\n".join(lines),
+        ephemeral=True,
+    )
 
 @bot.tree.command(name="cleartracker", description="Clear the spanner tracker (Admin only)")
 async def cleartracker(interaction: discord.Interaction):
@@ -167,8 +239,7 @@ async def cleartracker(interaction: discord.Interaction):
         await interaction.response.send_message("You don't have permission to use this command! Only admins can clear the spanner tracker.", ephemeral=True)
         return
 
-    queue_manager.spanner_tracker = []
-    queue_manager.save_spanner_tracker()
+    lobbies.spanners.clear()
     await interaction.response.send_message("The spanner tracker has been cleared! Everyone gets a fresh start!", ephemeral=True)
 
 @bot.tree.command(name="spannerhelp", description="Learn how the bot works and what spanners are!")
@@ -181,7 +252,8 @@ Here's how it works:
     - Use `/keen` followed by a number to give a conditional keen.
     - During the ready check, you have **10 minutes** to react with ✅. If you don't, you'll be marked as a **spanner**! 🔧
 - Use `/unkeen` to leave the queue, but beware: you'll also be marked as a spanner and put on a 5-minute cooldown.
-- Use `/spanners` to see who's been spannered and how many times.
+- Use `/spanners` to see who's been spannered and how many times, all time or recently.
+- Use `/spannerhistory` to see when and why you (or someone else) spannered.
 - Use `/cleartracker` to wipe the spanner slate clean (admin only).
 - Use `/keeners` to see who's currently in the queue.
     """
@@ -189,21 +261,19 @@ Here's how it works:
 
 @bot.tree.command(name="p", description="Indicate you're potentially keen")
 async def potentially_keen(interaction: discord.Interaction):
-    user = interaction.user.mention
-    if user in queue_manager.keen_queue:
-        await interaction.response.send_message(f"{user}, you're already in the queue! You can't mark yourself as potentially keen.", ephemeral=True)
-    else:
-        if user in queue_manager.potential_queue:
-            queue_manager.potential_queue.remove(user)
-            await interaction.response.send_message(f"{user}, you're no longer potentially keen.", ephemeral=True)
-        else:
-            queue_manager.potential_queue.add(user)
-            await interaction.response.send_message(f"{user}, you're now potentially keen! You'll be tagged if the queue is more than half full.", ephemeral=False)
+    await bot_commands.potentially_keen_command(interaction, lobbies.for_interaction(interaction))
 
-# Command to manually sync commands
+# Command to manually sync commands; `!sync force` syncs even if nothing changed
 @bot.command()
-async def sync(ctx):
-    await bot.tree.sync()
-    await ctx.send("Commands synced globally.")
+async def sync(ctx, option: str = None):
+    if await sync_commands(bot, force=option == "force"):
+        await ctx.send("Commands synced globally.")
+    else:
+        await ctx.send("Commands are already up to date. Use `!sync force` to sync anyway.")
+
+bot.run(TOKEN)
+
+# Write out any spanners still waiting in the store's batch, and a final checkpoint of the queues and conditional keens
+lobbies.spanners.store.flush_sync()
+lobbies.save()
 
-bot.run(TOKEN)
\ No newline at end of file
@@ -1,66 +1,310 @@
 import discord
 import time
-import asyncio
 import logging
 from queue_manager import QueueManager
+from reaction_router import PendingVote
+from keen_queue import FLAG_CONDITIONAL, FLAG_READIED
+from utils import mention
+from metrics import metrics
+from spanner_store import REASON_UNKEEN, REASON_READY_CHECK, REASON_CONDITIONAL_DECLINE, REASON_CONDITIONAL_NO_RESPONSE
 
-async def make_keen(interaction: discord.Interaction, queue_manager: QueueManager):
-    user = interaction.user.mention
-    if user in queue_manager.keen_queue:
-        await interaction.response.send_message(f"{user}, you're already in the queue!", ephemeral=True)
+def keen_change(client: discord.Client, queue_manager: QueueManager, user_id):
+    """Join the queue now. Runs on the lobby actor; returns (reply, announcement)."""
+    user = mention(user_id)
+    if user_id in queue_manager.keen_queue:
+        return f"{user}, you're already in the queue!", None
+    if queue_manager.ready_check_active or len(queue_manager.keen_queue) >= queue_manager.QUEUE_LIMIT:
+        return "The queue is full and a ready check is under way. Try again once it's over!", None
+    position = join_queue(queue_manager, user_id)
+    return (
+        f"You've joined the queue at position {position}/{queue_manager.QUEUE_LIMIT}.",
+        f"{user} has joined the queue at position {position}/{queue_manager.QUEUE_LIMIT}.",
+    )
+
+def conditional_keen_change(client: discord.Client, queue_manager: QueueManager, user_id, minutes):
+    """Ask the user if they're keen in `minutes`. Runs on the lobby actor."""
+    user = mention(user_id)
+    if user_id in queue_manager.keen_queue:
+        return f"{user}, you're already in the queue!", None
+    # Replace any earlier conditional keen, so a reaction to its check-in can't answer this one
+    queue_manager.remove_conditional(user_id)
+    # Add the user to the conditional queue; only their ID and deadline are kept
+    schedule_conditional_keen(client, queue_manager, user_id, time.time() + (minutes * 60))
+    logging.info(f"Added {user} to conditional queue. Will check back in {minutes} minutes.")
+    return f"You'll be asked if you're keen in {minutes} minutes.", f"{user} will be asked if they're keen in {minutes} minutes."
+
+def unkeen_change(client: discord.Client, queue_manager: QueueManager, user_id):
+    """Leave the queue, take a spanner and go on cooldown. Runs on the lobby actor."""
+    user = mention(user_id)
+    if user_id in queue_manager.unkeen_cooldown:
+        remaining = queue_manager.unkeen_cooldown[user_id] - time.time()
+        if remaining > 0:
+            minutes, seconds = divmod(remaining, 60)
+            return f"You're on cooldown! Try again in {int(minutes)}m {int(seconds)}s.", None
+
+    if user_id not in queue_manager.keen_queue:
+        return f"{user}, you're not in the queue!", None
+    queue_manager.remove_from_queue(user_id)
+    if queue_manager.ready_check is not None:
+        # The rest of the lobby can still finish the ready check without them
+        vote = queue_manager.reaction_router.get(queue_manager.ready_check["message_id"])
+        if vote is not None:
+            vote.withdraw(user_id)
+    queue_manager.start_unkeen_cooldown(user_id)
+    queue_manager.record_spanner(user_id, user, REASON_UNKEEN)
+    return f"{user} has been removed from the queue.", f"{user} is spannering :wrench:"
+
+def potentially_keen_change(client: discord.Client, queue_manager: QueueManager, user_id):
+    """Toggle being potentially keen. Runs on the lobby actor."""
+    user = mention(user_id)
+    if user_id in queue_manager.keen_queue:
+        return f"{user}, you're already in the queue! You can't mark yourself as potentially keen.", None
+    if user_id in queue_manager.potential_queue:
+        queue_manager.remove_potential(user_id)
+        return f"{user}, you're no longer potentially keen.", None
+    queue_manager.add_potential(user_id)
+    return (
+        "You're now potentially keen! You'll be tagged if the queue is more than half full.",
+        f"{user} is potentially keen!",
+    )
+
+def lobby_actor(queue_manager: QueueManager):
+    """The lobby's actor, wired to start ready checks and ping potentials after each pass."""
+    actor = queue_manager.actor
+    if actor.on_batch is None:
+        actor.on_batch = lambda client: check_queue_progress(client, queue_manager.YOUR_CHANNEL_ID, queue_manager)
+    return actor
+
+async def run_change(interaction: discord.Interaction, queue_manager: QueueManager, kind, change, *args):
+    """Defer straight away, apply the change on the lobby actor, then send its reply."""
+    # Acknowledge inside Discord's 3-second window however long the lobby's backlog is
+    with metrics.timer("spanner_rest_seconds", call="interaction.defer"):
+        await interaction.response.defer(ephemeral=True)
+    client = interaction.client
+    user_id = interaction.user.id
+    try:
+        reply = await lobby_actor(queue_manager).submit(client, user_id, kind, lambda: change(client, queue_manager, user_id, *args))
+    except Exception:
+        reply = "Something went wrong, please try again."
+    try:
+        with metrics.timer("spanner_rest_seconds", call="followup.send"):
+            await interaction.followup.send(reply, ephemeral=True)
+    except discord.HTTPException as e:
+        logging.error(f"Failed to reply to /{kind} from {user_id}: {e}")
+
+async def keen_command(interaction: discord.Interaction, queue_manager: QueueManager, minutes=None):
+    """/keen: join the queue now, or after `minutes` as a conditional keen."""
+    if minutes is not None:
+        await run_change(interaction, queue_manager, "conditional_keen", conditional_keen_change, minutes)
     else:
-        if user in queue_manager.potential_queue:
-            queue_manager.potential_queue.remove(user)
-        queue_manager.keen_queue[user] = time.time()
-        position = len(queue_manager.keen_queue)
-        await interaction.followup.send(f"{user} has joined the queue at position {position}/{queue_manager.QUEUE_LIMIT}.", ephemeral=False)
-        if len(queue_manager.keen_queue) >= queue_manager.QUEUE_LIMIT:
-            if queue_manager.YOUR_CHANNEL_ID is None:
-                logging.error("YOUR_CHANNEL_ID not set. Cannot start ready check.")
-                return
-            await ready_check(interaction, queue_manager)
-        elif len(queue_manager.keen_queue) > queue_manager.QUEUE_LIMIT // 2:  # More than half full
-            await notify_potentials(interaction, queue_manager)
+        await run_change(interaction, queue_manager, "keen", keen_change)
+
+async def unkeen_command(interaction: discord.Interaction, queue_manager: QueueManager):
+    """/unkeen: leave the queue, take a spanner and go on cooldown."""
+    await run_change(interaction, queue_manager, "unkeen", unkeen_change)
+
+async def keeners_command(interaction: discord.Interaction, queue_manager: QueueManager):
+    """/keeners: show the current queue."""
+    # Read-only, so it answers directly instead of waiting its turn on the actor
+    if queue_manager.keen_queue or queue_manager.potential_queue:
+        queue_list = "\n".join(f"{i+1}. {mention(user_id)}" for i, user_id in enumerate(queue_manager.keen_queue))
+        potential_list = "\n".join(f"Potential: {mention(user_id)}" for user_id in queue_manager.potential_queue)
+        content = f"Current queue:\n{queue_list}\n\nPotential keens:\n{potential_list}"
+    else:
+        content = "The queue is currently empty."
+    with metrics.timer("spanner_rest_seconds", call="interaction.send_message"):
+        await interaction.response.send_message(content, ephemeral=True)
+
+async def potentially_keen_command(interaction: discord.Interaction, queue_manager: QueueManager):
+    """/p: toggle being potentially keen."""
+    await run_change(interaction, queue_manager, "p", potentially_keen_change)
+
+def join_queue(queue_manager: QueueManager, user_id, flags=0):
+    """Move a user from the potential queue into the keen queue and return their position."""
+    return queue_manager.add_to_queue(user_id, flags)  # A new joiner leaves the potential queue
+
+def check_queue_progress(client: discord.Client, channel_id, queue_manager: QueueManager):
+    """Start a ready check once the queue is full, or ping potentials once it's half full.
+
+    Synchronous, so the check and the ready_check_active flag can't be split by an await.
+    """
+    if queue_manager.ready_check_active:
+        return  # This lobby's ready check is already running
+    if len(queue_manager.keen_queue) >= queue_manager.QUEUE_LIMIT:
+        if queue_manager.YOUR_CHANNEL_ID is None:
+            logging.error("YOUR_CHANNEL_ID not set. Cannot start ready check.")
+            return
+        queue_manager.ready_check_active = True
+        queue_manager.actor.spawn(ready_check(client, channel_id, queue_manager))
+    elif len(queue_manager.keen_queue) > queue_manager.QUEUE_LIMIT // 2:  # More than half full
+        notify_potentials(client, queue_manager)
 
-async def ready_check(interaction: discord.Interaction, queue_manager: QueueManager):
+async def ready_check(client: discord.Client, channel_id, queue_manager: QueueManager):
     queue_manager.ready_check_active = True
+    started = time.perf_counter()
+    outcome = "failed"  # Until we know better
     if queue_manager.YOUR_CHANNEL_ID is None:
         print("YOUR_CHANNEL_ID not set. Cannot start ready check.")
         return
     
-    tag_list = " ".join(queue_manager.keen_queue.keys())
-    message = await interaction.channel.send(f"{tag_list} ALL ABOARD THE KEEN TRAIN! React with ✅ if you're ready in the next 10 minutes or face spannering! :wrench:")
-    await message.add_reaction("✅")
+    keeners = list(queue_manager.keen_queue)
+    tag_list = " ".join(mention(user_id) for user_id in keeners)
+    message = await queue_manager.send_message_to_channel(client, channel_id, f"{tag_list} ALL ABOARD THE KEEN TRAIN! React with ✅ if you're ready in the next 10 minutes or face spannering! :wrench:", coalesce=False)
+    if message is None:
+        queue_manager.ready_check_active = False
+        metrics.inc("spanner_ready_checks_total", outcome=outcome)
+        return
+    vote = queue_manager.reaction_router.register(message.id, PendingVote(keeners, ["✅"]))
+    queue_manager.start_ready_check(message.id, keeners, time.time() + queue_manager.READY_CHECK_TIMEOUT)
 
-    reacted_users = set()
+    try:
+        with metrics.timer("spanner_rest_seconds", call="message.add_reaction"):
+            await message.add_reaction("✅")
+        if await vote.wait(queue_manager.READY_CHECK_TIMEOUT):
+            if not vote.voters:
+                outcome = "cancelled"
+                queue_manager.queue_message(client, channel_id, "Everyone left the queue, so the ready check is off.")
+                return
+            outcome = "ready"
+            queue_manager.queue_message(client, channel_id, "Everyone is ready! Have a spanner-free time!")
+            queue_manager.clear_queue()
+            return
 
-    def check(reaction, user):
-        return reaction.emoji == "✅" and user.mention in queue_manager.keen_queue and reaction.message.id == message.id
+        outcome = "timed_out"
 
-    try:
-        while len(reacted_users) < len(queue_manager.keen_queue):
-            reaction, user = await interaction.client.wait_for('reaction_add', timeout=600.0, check=check)
-            reacted_users.add(user.mention)
-        await interaction.channel.send("Everyone is ready! Have a spanner-free time!")
-        queue_manager.keen_queue.clear()
-    except asyncio.TimeoutError:
-        unreacted_users = [user for user in queue_manager.keen_queue.keys() if user not in reacted_users]
-        for user_mention in unreacted_users:
-            user_id = int(user_mention.strip('<@!>'))
-            queue_manager.spanner_tracker.append((user_id, user_mention))
-            queue_manager.save_spanner_tracker()
-            await interaction.channel.send(f"{user_mention} spannered by not readying up in time! :wrench:")
+        for user_id in keeners:
+            if user_id in vote.votes or user_id not in queue_manager.keen_queue:
+                continue  # Readied up, or already left (and was spannered for it)
+            queue_manager.record_spanner(user_id, mention(user_id), REASON_READY_CHECK)
+            queue_manager.remove_from_queue(user_id)
+            queue_manager.queue_message(client, channel_id, f"{mention(user_id)} spannered by not readying up in time! :wrench:")
         # Re-add users who reacted to the queue
-        for user in reacted_users:
-            queue_manager.keen_queue[user] = time.time()
-        await interaction.channel.send("Users who readied up have been re-added to the queue.")
+        for user_id in vote.votes:
+            queue_manager.add_to_queue(user_id, FLAG_READIED)
+        queue_manager.queue_message(client, channel_id, "Users who readied up have been re-added to the queue.")
     finally:
-        queue_manager.ready_check_active = False
+        queue_manager.reaction_router.unregister(message.id)
+        queue_manager.end_ready_check()
+        metrics.observe("spanner_ready_check_seconds", time.perf_counter() - started, outcome=outcome)
+        metrics.inc("spanner_ready_checks_total", outcome=outcome)
+
+async def resume_lobby(client: discord.Client, queue_manager: QueueManager):
+    """Pick a restored lobby back up: settle a ready check cut off by the restart, or start one if the queue is full."""
+    record = queue_manager.ready_check
+    channel_id = queue_manager.YOUR_CHANNEL_ID
+    if record is None:
+        check_queue_progress(client, channel_id, queue_manager)
+        return
+
+    keeners = [user_id for user_id in record["keeners"] if user_id in queue_manager.keen_queue]
+    ready = await fetch_ready_votes(client, queue_manager, channel_id, record["message_id"])
+    if keeners and ready is not None and all(user_id in ready for user_id in keeners):
+        queue_manager.end_ready_check()
+        queue_manager.queue_message(client, channel_id, "Everyone is ready! Have a spanner-free time!")
+        queue_manager.clear_queue()
+        metrics.inc("spanner_ready_checks_total", outcome="ready")
+        return
 
-async def notify_potentials(interaction: discord.Interaction, queue_manager: QueueManager):
+    # Reactions sent while the bot was down were missed, so nobody is spannered for them: start over
+    queue_manager.end_ready_check()
+    if queue_manager.keen_queue:
+        queue_manager.queue_message(client, channel_id, "The bot restarted during the ready check, so here's a fresh one!")
+    check_queue_progress(client, channel_id, queue_manager)
+
+async def fetch_ready_votes(client: discord.Client, queue_manager: QueueManager, channel_id, message_id):
+    """IDs of users who reacted ✅ to a ready check message, or None if it can't be read."""
+    try:
+        channel = queue_manager.outbound.channel(client, channel_id) or client.get_partial_messageable(channel_id)
+        with metrics.timer("spanner_rest_seconds", call="channel.fetch_message"):
+            message = await channel.fetch_message(message_id)
+        for reaction in message.reactions:
+            if str(reaction.emoji) == "✅":
+                return {user.id async for user in reaction.users()}
+        return set()
+    except discord.HTTPException as e:
+        logging.error(f"Couldn't read ready check {message_id} in channel {channel_id}: {e}")
+        return None
+
+def notify_potentials(client: discord.Client, queue_manager: QueueManager):
     if queue_manager.potential_queue:
         if queue_manager.YOUR_CHANNEL_ID is None:
             print("YOUR_CHANNEL_ID not set. Cannot notify potential keens.")
             return
-        tag_list = " ".join(queue_manager.potential_queue)
-        await queue_manager.send_message_to_channel(interaction.client, queue_manager.YOUR_CHANNEL_ID, f"Hey {tag_list}, the queue is more than half full! Use `/keen` to join if you're ready! 🚂")
\ No newline at end of file
+        tag_list = " ".join(mention(user_id) for user_id in queue_manager.potential_queue)
+        queue_manager.queue_message(client, queue_manager.YOUR_CHANNEL_ID, f"Hey {tag_list}, the queue is more than half full! Use `/keen` to join if you're ready! 🚂")
+
+def schedule_conditional_keen(bot: discord.Client, queue_manager: QueueManager, user_id, deadline):
+    """Persist a conditional keen and schedule its check-in."""
+    queue_manager.add_conditional(user_id, deadline)
+    queue_manager.schedule_job("conditional", user_id, deadline, conditional_check_in, bot, queue_manager, user_id)
+
+def restore_conditional_keens(bot: discord.Client, queue_manager: QueueManager):
+    """Reschedule conditional keens loaded from disk. Overdue check-ins fire straight away."""
+    for user_id, entry in queue_manager.conditional_queue.items():
+        if queue_manager.has_job("conditional", user_id):
+            continue
+        if entry["message_id"] is None:
+            callback = conditional_check_in
+        else:
+            callback = conditional_no_response
+            register_conditional_vote(bot, queue_manager, user_id, entry["message_id"])
+        queue_manager.schedule_job("conditional", user_id, entry["deadline"], callback, bot, queue_manager, user_id)
+    logging.info(f"Restored {len(queue_manager.conditional_queue)} conditional keens.")
+
+async def conditional_check_in(bot: discord.Client, queue_manager: QueueManager, user_id):
+    """Ask a conditional keener if they're still keen once their delay is up."""
+    # Check if the user is still in the conditional queue (they might have left manually)
+    if user_id not in queue_manager.conditional_queue:
+        return
+
+    user = mention(user_id)
+    logging.info(f"Checking if {user} is still keen...")
+    message = await queue_manager.send_message_to_channel(bot, queue_manager.YOUR_CHANNEL_ID, f"{user}, are you still keen? React with ✅ to join the queue or ❌ to decline.", coalesce=False)
+    if not message:  # Ensure the message was sent successfully
+        logging.error(f"Failed to send message to channel {queue_manager.YOUR_CHANNEL_ID}.")
+        queue_manager.remove_conditional(user_id)
+        return
+
+    # The answer arrives through the reaction router, the timeout through the scheduler
+    deadline = time.time() + queue_manager.CONDITIONAL_RESPONSE_TIMEOUT
+    queue_manager.set_conditional_message(user_id, message.id, deadline)
+    register_conditional_vote(bot, queue_manager, user_id, message.id)
+    queue_manager.schedule_job("conditional", user_id, deadline, conditional_no_response, bot, queue_manager, user_id)
+    with metrics.timer("spanner_rest_seconds", call="message.add_reaction"):
+        await message.add_reaction("✅")
+        await message.add_reaction("❌")
+
+async def conditional_no_response(bot: discord.Client, queue_manager: QueueManager, user_id):
+    """Mark a conditional keener as a spanner if they don't respond within 5 minutes."""
+    if not queue_manager.remove_conditional(user_id):
+        return
+    user = mention(user_id)
+    queue_manager.record_spanner(user_id, user, REASON_CONDITIONAL_NO_RESPONSE)
+    queue_manager.queue_message(bot, queue_manager.YOUR_CHANNEL_ID, f"{user} spannered by not responding in time! :wrench:")
+
+def register_conditional_vote(bot: discord.Client, queue_manager: QueueManager, user_id, message_id):
+    """Route ✅/❌ reactions from the user on their check-in message to handle_conditional_reaction."""
+    async def on_vote(_, emoji):
+        await handle_conditional_reaction(bot, queue_manager, user_id, emoji)
+
+    queue_manager.reaction_router.register(message_id, PendingVote([user_id], ["✅", "❌"], on_vote=on_vote))
+
+async def handle_conditional_reaction(bot: discord.Client, queue_manager: QueueManager, user_id, emoji):
+    """Apply a ✅ or ❌ answer to a conditional check-in on the lobby actor."""
+    await lobby_actor(queue_manager).submit(bot, user_id, "conditional_answer", lambda: conditional_answer_change(bot, queue_manager, user_id, emoji))
+
+def conditional_answer_change(bot: discord.Client, queue_manager: QueueManager, user_id, emoji):
+    if not queue_manager.remove_conditional(user_id):
+        return None, None
+
+    user = mention(user_id)
+    if emoji == "✅":
+        if user_id in queue_manager.keen_queue:
+            return None, None
+        if queue_manager.ready_check_active or len(queue_manager.keen_queue) >= queue_manager.QUEUE_LIMIT:
+            return None, f"{user} is still keen, but the queue is full. Use `/keen` once the ready check is over!"
+        position = join_queue(queue_manager, user_id, FLAG_CONDITIONAL)
+        return None, f"{user} is still keen and has been added to the queue at position {position}/{queue_manager.QUEUE_LIMIT}!"
+    # Mark the user as a spanner
+    queue_manager.record_spanner(user_id, user, REASON_CONDITIONAL_DECLINE)
+    return None, f"{user} declined and has been marked as a spanner! :wrench:"
@@ -0,0 +1,45 @@
+import hashlib
+import json
+import logging
+import os
+from utils import atomic_write_json
+
+
+def command_signature(bot):
+    """Stable hash of the app commands registered on the bot's tree."""
+    payload = sorted(
+        (command.to_dict(bot.tree) for command in bot.tree.get_commands()),
+        key=lambda command: (command.get("type", 1), command["name"]),
+    )
+    data = json.dumps({"application_id": bot.application_id, "commands": payload}, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+async def sync_commands(bot, force=False, path='command_sync.json'):
+    """Sync the command tree globally only if it changed since the last successful sync.
+
+    Returns True if a sync was sent to Discord.
+    """
+    signature = command_signature(bot)
+    if not force and _load_signature(path) == signature:
+        logging.info("Commands unchanged since last sync, skipping.")
+        return False
+
+    await bot.tree.sync()
+    try:
+        atomic_write_json(path, {"signature": signature})
+    except Exception as e:
+        logging.error(f"Error saving command signature: {e}")
+    logging.info("Commands synced globally.")
+    return True
+
+
+def _load_signature(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("signature")
+    except Exception as e:
+        logging.error(f"Error loading command signature: {e}")
+        return None
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import logging
+import os
+from utils import atomic_write_json
+from metrics import metrics
+
+
+class ConditionalStore:
+    """Pending conditional keens for every lobby, written behind to one JSON file.
+
+    Each lobby attaches its own `conditional_queue` dict; `save()` marks the
+    store dirty and a single task writes every attached queue atomically
+    from a worker thread, so bursts of changes cost one write.
+    """
+
+    def __init__(self, path='conditional_queue.json'):
+        self.path = path
+        self.queues = {}  # {(guild_id, channel_id): {user_id: {"deadline": ..., "message_id": ...}}}
+        self._save_task = None
+        self._dirty = False
+
+    def attach(self, key, conditional_queue):
+        self.queues[key] = conditional_queue
+
+    def detach(self, key):
+        self.queues.pop(key, None)
+
+    def save(self):
+        """Write every conditional queue to disk, off the event loop when one is running."""
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save_sync()
+            return
+        if self._save_task is None or self._save_task.done():
+            self._save_task = loop.create_task(self._save_later())
+
+    def save_sync(self):
+        """Write every conditional queue immediately, e.g. on shutdown."""
+        self._dirty = False
+        atomic_write_json(self.path, self._snapshot())
+
+    async def flush(self):
+        """Write every conditional queue now, from a worker thread."""
+        self._dirty = False
+        await asyncio.to_thread(atomic_write_json, self.path, self._snapshot())
+
+    async def _save_later(self):
+        # Coalesce bursts of changes into one write per pass
+        while self._dirty:
+            self._dirty = False
+            try:
+                with metrics.timer("spanner_flush_seconds", store="conditional_queue"):
+                    await asyncio.to_thread(atomic_write_json, self.path, self._snapshot())
+            except Exception as e:
+                logging.error(f"Error saving conditional queue: {e}")
+                return
+
+    def _snapshot(self):
+        return rows(self.queues)
+
+    def load(self):
+        """Read saved conditional keens, grouped as {(guild_id, channel_id): {user_id: entry}}."""
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logging.error(f"Error loading conditional queue: {e}")
+            return {}
+        return group_rows(data)
+
+
+def rows(queues):
+    """Flatten {(guild_id, channel_id): {user_id: entry}} into one JSON-ready row per conditional keen."""
+    return [
+        {"guild_id": guild_id, "channel_id": channel_id, "user_id": user_id, **entry}
+        for (guild_id, channel_id), queue in queues.items()
+        for user_id, entry in queue.items()
+    ]
+
+
+def group_rows(data):
+    """The reverse of `rows`."""
+    queues = {}
+    for row in data:
+        key = (row["guild_id"], row["channel_id"])
+        queues.setdefault(key, {})[row["user_id"]] = {"deadline": row["deadline"], "message_id": row["message_id"]}
+    return queues
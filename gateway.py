@@ -0,0 +1,117 @@
+import logging
+import resource
+import sys
+from collections import OrderedDict
+
+import discord
+
+
+def lean_intents():
+    """Only the intents the bot's features use.
+
+    guilds keeps channel and guild metadata (notification channels, ready
+    checks); guild_reactions delivers raw reaction events for ready checks
+    and check-ins; guild_messages and message_content are for `!sync`.
+    Slash commands need no intents at all.
+    """
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_reactions = True
+    intents.guild_messages = True
+    intents.message_content = True
+    return intents
+
+
+def client_options(lean=False, message_cache_size=None):
+    """Keyword arguments for commands.Bot: the default gateway setup, or the lean one.
+
+    Lean mode also turns off the message cache (reactions arrive as raw
+    events, so cached messages are never read) and member caching, and
+    skips chunking every guild's member list at startup.
+    """
+    if not lean:
+        intents = discord.Intents.default()
+        intents.message_content = True
+        options = {"intents": intents}
+        if message_cache_size is not None:
+            options["max_messages"] = message_cache_size or None
+        return options
+    return {
+        "intents": lean_intents(),
+        "max_messages": message_cache_size or None,  # None disables the cache
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+        "chunk_guilds_at_startup": False,
+    }
+
+
+class EntityCache:
+    """Small LRU of channels resolved on demand.
+
+    `channel()` never needs a REST call: it falls back to a
+    PartialMessageable, which is enough to send messages, add reactions
+    and fetch a message. Every channel lookup the bot makes goes through
+    it, via OutboundPipeline.resolve_channel.
+    """
+
+    def __init__(self, bot, maxsize=256):
+        self.bot = bot
+        self.maxsize = maxsize
+        self._channels = OrderedDict()  # {channel_id: channel}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._channels)
+
+    def channel(self, channel_id):
+        """Return a channel to send to, from the client cache, this LRU or a partial messageable."""
+        cached = self._get(self._channels, channel_id)
+        if cached is not None:
+            return cached
+        channel = self.bot.get_channel(channel_id) or self.bot.get_partial_messageable(channel_id)
+        self._put(self._channels, channel_id, channel)
+        return channel
+
+    def _get(self, cache, key):
+        value = cache.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        cache.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def _put(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.maxsize:
+            cache.popitem(last=False)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def cache_report(bot, entities=None):
+    """Sizes of the client caches, to check memory stays flat as the bot joins guilds."""
+    guilds = bot.guilds
+    report = {
+        "guilds": len(guilds),
+        "channels": sum(len(guild.channels) for guild in guilds),
+        "members": sum(len(guild.members) for guild in guilds),
+        "users": len(bot.users),
+        "messages": len(bot.cached_messages),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    if entities is not None:
+        report["entity_cache"] = len(entities)
+    return report
+
+
+def log_cache_report(bot, entities=None):
+    report = cache_report(bot, entities)
+    logging.info("Cache sizes: " + ", ".join(f"{name}={value}" for name, value in report.items()))
+    return report
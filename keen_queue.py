@@ -0,0 +1,115 @@
+import time
+from array import array
+
+# QueueEntry flags
+FLAG_REJOINED = 1  # Re-added automatically after a timeout's rejoin window
+FLAG_CONDITIONAL = 2  # Joined by answering a conditional /keen check-in
+FLAG_READIED = 4  # Readied up in a ready check that didn't fill and was re-added
+
+
+class QueueEntry:
+    __slots__ = ("user_id", "joined_at", "slot", "flags")
+
+    def __init__(self, user_id, joined_at, slot, flags=0):
+        self.user_id = user_id
+        self.joined_at = joined_at
+        self.slot = slot  # Index in the position tree, increases with join order
+        self.flags = flags
+
+
+class KeenQueue:
+    """Keen queue keyed by integer user ID.
+
+    Entries live in an insertion-ordered dict for O(1) membership checks
+    and removal. Each join takes the next slot in a Fenwick tree holding a
+    1 for every occupied slot, so a user's current position is the prefix
+    sum up to their slot: O(log n) to look up and to update when someone
+    leaves from the middle. Slots are renumbered when the tree fills up.
+    """
+
+    def __init__(self, capacity=64):
+        self._entries = {}  # {user_id: QueueEntry} in queue order
+        self._tree = array('i', [0]) * (capacity + 1)
+        self._next_slot = 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __bool__(self):
+        return bool(self._entries)
+
+    def get(self, user_id):
+        return self._entries.get(user_id)
+
+    def items(self):
+        """[(user_id, QueueEntry)] in queue order."""
+        return list(self._entries.items())
+
+    def add(self, user_id, joined_at=None, flags=0):
+        """Add a user to the back of the queue and return their position."""
+        if user_id in self._entries:
+            return self.position(user_id)
+        if self._next_slot >= len(self._tree):
+            self._rebuild()
+        slot = self._next_slot
+        self._next_slot += 1
+        self._entries[user_id] = QueueEntry(user_id, joined_at if joined_at is not None else time.time(), slot, flags)
+        self._update(slot, 1)
+        return len(self._entries)
+
+    def touch(self, user_id, joined_at, flags=0):
+        """Restart a queued user's clock and add `flags`, keeping their place. Returns their entry, or None."""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry.joined_at = joined_at
+            entry.flags |= flags
+        return entry
+
+    def remove(self, user_id):
+        """Remove a user from anywhere in the queue. Returns their entry, or None."""
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._update(entry.slot, -1)
+        return entry
+
+    def position(self, user_id):
+        """Return a user's 1-based position in the queue, or None."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        total = 0
+        i = entry.slot
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def clear(self):
+        self._entries.clear()
+        self._tree = array('i', [0]) * len(self._tree)
+        self._next_slot = 1
+
+    def _update(self, i, delta):
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _rebuild(self):
+        # Renumber live entries 1..n and build the tree in O(n)
+        size = max(64, 2 * len(self._entries))
+        tree = array('i', [0]) * (size + 1)
+        for slot, entry in enumerate(self._entries.values(), start=1):
+            entry.slot = slot
+            tree[slot] = 1
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._next_slot = len(self._entries) + 1
@@ -0,0 +1,71 @@
+"""Run the bot as several processes, each owning a group of shards.
+
+Usage:
+    python launcher.py --shards 8 --processes 4
+
+Each process runs bot.py as an AutoShardedBot for its share of the shards,
+with SHARD_COUNT, SHARD_GROUPS and SHARD_GROUP set. Processes that exit
+unexpectedly are restarted; Ctrl+C stops them all.
+"""
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from sharding import shard_groups
+
+RESTART_DELAY = 10  # Seconds before restarting a process that exited
+
+
+def spawn(group, shard_count, group_count):
+    env = dict(os.environ, SHARD_COUNT=str(shard_count), SHARD_GROUPS=str(group_count), SHARD_GROUP=str(group))
+    logging.info(f"Starting shard group {group}: shards {shard_groups(shard_count, group_count)[group]}")
+    return subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")], env=env)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, required=True, help="Total shard count")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Processes to split the shards across")
+    args = parser.parse_args()
+    group_count = max(1, min(args.processes, args.shards))
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    processes = {group: spawn(group, args.shards, group_count) for group in range(group_count)}
+    restart_at = {}  # {group: time to restart it}, so one crash doesn't hold up the others or Ctrl+C
+    while not stopping:
+        time.sleep(1)
+        now = time.monotonic()
+        for group, process in processes.items():
+            if group in restart_at:
+                if now >= restart_at[group] and not stopping:
+                    del restart_at[group]
+                    processes[group] = spawn(group, args.shards, group_count)
+            elif process.poll() is not None:
+                logging.error(f"Shard group {group} exited with code {process.returncode}, restarting in {RESTART_DELAY}s.")
+                restart_at[group] = now + RESTART_DELAY
+
+    logging.info("Stopping all shard groups...")
+    for process in processes.values():
+        if process.poll() is None:
+            process.send_signal(signal.SIGINT)  # Lets bot.py flush spanners and checkpoint lobbies
+    for process in processes.values():
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+if __name__ == "__main__":
+    main()
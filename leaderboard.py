@@ -0,0 +1,66 @@
+from bisect import bisect_left, insort
+
+
+class SpannerLeaderboard:
+    """Per-user spanner counts kept in leaderboard order as spanners are added.
+
+    `_order` is a sorted list of (-count, user_id) so the biggest spannerers
+    come first. Adding a spanner moves one entry, so top-K pages, ranks and
+    counts never need to scan the raw spanner list.
+    """
+
+    def __init__(self):
+        self.counts = {}  # {user_id: spanner_count}
+        self.mentions = {}  # {user_id: mention}
+        self._order = []  # [(-count, user_id)] sorted
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, user_id, mention, amount=1):
+        """Add `amount` spanners to a user and move them to their new position."""
+        old = self.counts.get(user_id, 0)
+        if old:
+            del self._order[bisect_left(self._order, (-old, user_id))]
+        self.counts[user_id] = old + amount
+        self.mentions[user_id] = mention
+        insort(self._order, (-(old + amount), user_id))
+
+    def rebuild(self, records):
+        """Rebuild the index from an iterable of (user_id, mention) records."""
+        self.clear()
+        for user_id, mention in records:
+            self.counts[user_id] = self.counts.get(user_id, 0) + 1
+            self.mentions[user_id] = mention
+        self._order = sorted((-count, user_id) for user_id, count in self.counts.items())
+
+    def load_totals(self, totals):
+        """Rebuild the index from (user_id, mention, count) rows, e.g. from the spanner store."""
+        self.clear()
+        for user_id, mention, count in totals:
+            self.counts[user_id] = count
+            self.mentions[user_id] = mention
+        self._order = sorted((-count, user_id) for user_id, count in self.counts.items())
+
+    def clear(self):
+        self.counts.clear()
+        self.mentions.clear()
+        self._order = []
+
+    def count(self, user_id):
+        """Return how many spanners a user has."""
+        return self.counts.get(user_id, 0)
+
+    def rank(self, user_id):
+        """Return a user's 1-based rank (ties share a rank), or None if they have no spanners."""
+        count = self.counts.get(user_id)
+        if not count:
+            return None
+        return bisect_left(self._order, (-count,)) + 1
+
+    def top(self, limit, offset=0):
+        """Return [(rank, user_id, mention, count)] for one page of the leaderboard."""
+        page = []
+        for neg_count, user_id in self._order[offset:offset + limit]:
+            page.append((self.rank(user_id), user_id, self.mentions[user_id], -neg_count))
+        return page
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+import time
+from queue_manager import QueueManager
+from scheduler import DeadlineScheduler
+from reaction_router import ReactionRouter
+from outbound import OutboundPipeline
+from spanners import SpannerTracker
+from conditional_store import ConditionalStore, group_rows, rows
+from lobby_state import LobbyStateStore, state_from_json, state_to_json
+from sharding import Inbox, group_path
+
+
+class LobbyRegistry:
+    """Lazily created QueueManagers keyed by (guild_id, channel_id).
+
+    Every lobby has its own queues, actor and ready-check state, so ready
+    checks in different channels run side by side on the same event loop.
+    The scheduler, reaction router, outbound pipeline, spanner tracker and
+    conditional store are shared. Lobbies with nothing in them are evicted
+    after `idle_timeout` seconds, and so are channel outboxes with nothing
+    left to send, so memory follows active lobbies rather than every guild
+    the bot has seen.
+
+    With shard groups (`shards`), the lobby and conditional files get the
+    group's suffix and only the group's own guilds are restored. Lobbies
+    saved by a group that no longer owns them, e.g. after the shard or
+    process count changed, are handed to the owner's inbox instead.
+    """
+
+    def __init__(self, private_channel_id=None, idle_timeout=3600, sweep_interval=300,
+                 spanner_path='spanner_tracker.csv', conditional_path='conditional_queue.json', spanner_db_path='spanners.db',
+                 state_path='lobbies.json', state_log_path='lobbies.log', checkpoint_interval=30,
+                 shards=None, inbox_path='lobbies.inbox', spanner_refresh_interval=None):
+        self.private_channel_id = private_channel_id  # Optional notification channel override from .env
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self.lobbies = {}  # {(guild_id, channel_id): QueueManager}
+        self.scheduler = DeadlineScheduler()
+        self.reaction_router = ReactionRouter()
+        self.outbound = OutboundPipeline()
+        self.spanners = SpannerTracker(spanner_path, spanner_db_path)
+        self.shards = shards  # ShardPlan for this process, or None to own every guild
+        self._paths = (state_path, state_log_path, conditional_path, inbox_path)  # Unsuffixed, to find other groups' files
+        if shards is not None:
+            state_path, state_log_path, conditional_path, inbox_path = (shards.path(path) for path in self._paths)
+        self.conditional_store = ConditionalStore(conditional_path)
+        self.state = LobbyStateStore(state_path, state_log_path)  # Checkpoints plus a change log of every lobby's queues
+        self.inbox = Inbox(inbox_path) if shards is not None else None
+        self.checkpoint_interval = checkpoint_interval
+        self.on_handover = None  # Called with each lobby handed over by another group after load(), to resume it
+        self.spanner_refresh_interval = spanner_refresh_interval  # Re-read spanner totals shared with other processes
+        self.bot = None
+        self.loaded = False  # Lobbies are restored once per process, not on every reconnect
+
+    def __len__(self):
+        return len(self.lobbies)
+
+    def __iter__(self):
+        return iter(list(self.lobbies.values()))
+
+    def get(self, guild_id, channel_id):
+        """Return the lobby for a channel, creating it on first use."""
+        key = (guild_id, channel_id)
+        lobby = self.lobbies.get(key)
+        if lobby is None:
+            lobby = QueueManager(
+                guild_id=guild_id,
+                channel_id=channel_id,
+                scheduler=self.scheduler,
+                reaction_router=self.reaction_router,
+                outbound=self.outbound,
+                spanners=self.spanners,
+                conditional_store=self.conditional_store,
+                changes=self.state,
+            )
+            lobby.YOUR_CHANNEL_ID = self._notification_channel(guild_id, channel_id)
+            lobby.bot = self.bot
+            self.lobbies[key] = lobby
+            logging.info(f"Created lobby for guild {guild_id}, channel {channel_id} ({len(self.lobbies)} active).")
+        lobby.last_active = time.time()
+        return lobby
+
+    def for_interaction(self, interaction):
+        return self.get(interaction.guild_id, interaction.channel_id)
+
+    def _notification_channel(self, guild_id, channel_id):
+        # PRIVATE_CHANNEL_ID still takes over notifications for the guild it belongs to
+        if self.private_channel_id and self.bot is not None:
+            private_channel = self.outbound.channel(self.bot, self.private_channel_id)
+            if private_channel is not None and getattr(private_channel.guild, "id", None) == guild_id:
+                return self.private_channel_id
+        return channel_id
+
+    def evict_idle(self, now=None):
+        """Drop lobbies that have been idle for longer than `idle_timeout`. Returns how many went."""
+        now = now or time.time()
+        evicted = [
+            key for key, lobby in self.lobbies.items()
+            if now - lobby.last_active > self.idle_timeout and lobby.is_idle()
+        ]
+        for key in evicted:
+            del self.lobbies[key]
+            self.conditional_store.detach(key)
+        if evicted:
+            logging.info(f"Evicted {len(evicted)} idle lobbies ({len(self.lobbies)} active).")
+        return len(evicted)
+
+    def register_metrics(self, metrics):
+        """Expose lobby, queue and outbound sizes as gauges, read when the metrics are rendered."""
+        metrics.gauge("spanner_lobbies", lambda: len(self.lobbies), "Active lobbies")
+        metrics.gauge("spanner_queue_size", self._queue_sizes, "Users waiting across all lobbies, by queue")
+        metrics.gauge("spanner_ready_checks_active", lambda: sum(lobby.ready_check_active for lobby in self.lobbies.values()), "Ready checks in progress")
+        metrics.gauge("spanner_scheduled_jobs", lambda: len(self.scheduler), "Timeouts, cooldowns and check-ins waiting to fire")
+        metrics.gauge("spanner_outbound_queue_depth", lambda: self.outbound.queue_depth(), "Messages waiting to be sent")
+
+    def _queue_sizes(self):
+        keen = potential = conditional = 0
+        for lobby in self.lobbies.values():
+            keen += len(lobby.keen_queue)
+            potential += len(lobby.potential_queue)
+            conditional += len(lobby.conditional_queue)
+        return {(("queue", "keen"),): keen, (("queue", "potential"),): potential, (("queue", "conditional"),): conditional}
+
+    async def _sweep(self):
+        self.evict_idle()
+        self.outbound.evict_idle()
+        self.scheduler.schedule(("lobby_sweep",), time.time() + self.sweep_interval, self._sweep)
+
+    def _owned(self, guild_id):
+        return self.shards is None or self.shards.owns_guild(guild_id)
+
+    def _restore(self, states, conditional_queues, outgoing):
+        """Restore lobbies this group owns and add the rest to `outgoing` ({group: inbox entries}).
+
+        Returns the lobbies that were restored.
+        """
+        restored = {}
+        for key, state in states.items():
+            if self._owned(key[0]):
+                restored[key] = lobby = self.get(*key)
+                lobby.restore_state(state)
+            else:
+                outgoing.setdefault(self.shards.group_for_guild(key[0]), []).append({"lobby": state_to_json(state)})
+        for key, conditional_queue in conditional_queues.items():
+            if self._owned(key[0]):
+                restored[key] = lobby = self.get(*key)
+                lobby.conditional_queue.update(conditional_queue)
+            else:
+                outgoing.setdefault(self.shards.group_for_guild(key[0]), []).extend({"conditional": row} for row in rows({key: conditional_queue}))
+        return list(restored.values())
+
+    def _receive(self, entries, outgoing):
+        """Restore lobbies from inbox entries."""
+        states = {}
+        conditional = []
+        for entry in entries:
+            if "lobby" in entry:
+                state = state_from_json(entry["lobby"])
+                states[(state["guild_id"], state["channel_id"])] = state
+            else:
+                conditional.append(entry["conditional"])
+        return self._restore(states, group_rows(conditional), outgoing)
+
+    def _hand_over(self, outgoing):
+        """Post lobbies to the groups that own them now. Done before they're dropped from this group's files."""
+        for group, entries in outgoing.items():
+            logging.warning(f"Handing {len(entries)} lobby entries to shard group {group}, which owns their guilds now.")
+            inbox_path = self._paths[-1]
+            Inbox(self.shards.path(inbox_path, group)).post(entries)
+
+    def _stale_files(self):
+        """(state, log, conditional, inbox) paths left by groups that no longer exist, for the primary group to take over."""
+        if self.shards is None or not self.shards.is_primary:
+            return []
+        groups = []
+        for path in self._paths:
+            groups.extend(group for group in self.shards.stale_groups(path) if group not in groups)
+        return [tuple(group_path(path, group) for path in self._paths) for group in groups]
+
+    async def _refresh_spanners(self):
+        try:
+            await self.spanners.refresh()
+        except Exception as e:
+            logging.error(f"Error refreshing spanner totals: {e}")
+        self.scheduler.schedule(("spanner_refresh",), time.time() + self.spanner_refresh_interval, self._refresh_spanners)
+
+    async def _checkpoint(self):
+        # Until the saved lobbies are loaded, a checkpoint would replace them with nothing
+        if self.loaded:
+            try:
+                await self._check_inbox()
+                await self.state.checkpoint(self)
+            except Exception as e:
+                logging.error(f"Error writing lobby checkpoint: {e}")
+        self.scheduler.schedule(("lobby_checkpoint",), time.time() + self.checkpoint_interval, self._checkpoint)
+
+    async def _check_inbox(self):
+        # Groups that started after this one may hand over lobbies they loaded from their files
+        if self.inbox is None or not os.path.exists(self.inbox.path):
+            return
+        entries, size = await asyncio.to_thread(self.inbox.read)
+        if not size:
+            return
+        outgoing = {}
+        lobbies = self._receive(entries, outgoing)
+        self._hand_over(outgoing)
+        await self.state.checkpoint(self)
+        await self.conditional_store.flush()
+        await asyncio.to_thread(self.inbox.discard, size)
+        logging.info(f"Took over {len(lobbies)} lobbies from other shard groups.")
+        if self.on_handover is not None:
+            for lobby in lobbies:
+                self.on_handover(lobby)
+
+    def load(self, bot):
+        """Recreate lobbies from the last checkpoint and change log, plus pending conditional keens.
+
+        With shard groups this also takes in the group's inbox and, in the
+        primary group, files left by groups that no longer exist. Lobbies
+        another group owns go to its inbox before they're dropped from here.
+        """
+        self.bot = bot
+        self.loaded = True
+        start = time.perf_counter()
+        outgoing = {}
+        self._restore(self.state.load(), self.conditional_store.load(), outgoing)
+        stale = self._stale_files()
+        for state_path, log_path, conditional_path, inbox_path in stale:
+            logging.warning(f"Taking over lobbies from {state_path}, left by a different number of shard groups.")
+            self._restore(LobbyStateStore(state_path, log_path).load(), ConditionalStore(conditional_path).load(), outgoing)
+            self._receive(Inbox(inbox_path).read()[0], outgoing)
+        entries, size = self.inbox.read() if self.inbox is not None else ([], 0)
+        self._receive(entries, outgoing)
+        self._hand_over(outgoing)
+        # Fold the replayed log into a fresh checkpoint, which also drops any torn last line
+        self.state.checkpoint_sync(self)
+        self.conditional_store.save_sync()
+        # Only now that everything is in this group's own files (or another group's inbox)
+        if size:
+            self.inbox.discard(size)
+        for path in (path for paths in stale for path in paths):
+            if os.path.exists(path):
+                os.remove(path)
+        logging.info(f"Restored {len(self.lobbies)} lobbies in {(time.perf_counter() - start) * 1000:.1f}ms.")
+
+    def save(self):
+        """Write a final checkpoint and conditional keens, e.g. on shutdown. Does nothing if the saved lobbies were never loaded."""
+        if self.loaded:
+            self.state.checkpoint_sync(self)
+            # A save still waiting on the closed event loop would otherwise be lost
+            self.conditional_store.save_sync()
+
+    async def run(self, bot):
+        """Run the shared scheduler that drives every lobby's timeouts and check-ins."""
+        self.bot = bot
+        for lobby in self.lobbies.values():
+            lobby.bot = bot
+        self.scheduler.schedule(("lobby_sweep",), time.time() + self.sweep_interval, self._sweep)
+        self.scheduler.schedule(("lobby_checkpoint",), time.time() + self.checkpoint_interval, self._checkpoint)
+        if self.spanner_refresh_interval:
+            self.scheduler.schedule(("spanner_refresh",), time.time() + self.spanner_refresh_interval, self._refresh_spanners)
+        await self.scheduler.run()
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from collections import deque
+
+
+class LobbyActor:
+    """Single writer for one lobby's queue state.
+
+    Commands hand the actor a synchronous `change` instead of touching the
+    queues themselves. One worker task applies changes in arrival order with
+    no await between reading and updating the queues, so handlers racing
+    through a burst can't interleave, overfill the queue or start two ready
+    checks. A user who repeats a command while their first one is still
+    waiting shares its result rather than queueing a second change. After
+    each pass `on_batch(client)` runs once, and the pass's announcements are
+    queued together so the outbound pipeline posts them as one message.
+    """
+
+    def __init__(self, queue_manager, on_batch=None):
+        self.queue_manager = queue_manager
+        self.on_batch = on_batch  # Called with the client after every pass, e.g. to start a ready check
+        self._changes = deque()  # (key, change, future)
+        self._pending = {}  # {(user_id, kind): future} for changes not yet applied
+        self._client = None
+        self._worker = None
+        self._tasks = set()
+        self.applied = 0
+        self.coalesced = 0  # Repeated commands merged into one already waiting
+
+    def __len__(self):
+        return len(self._changes)
+
+    def busy(self):
+        """True while changes are waiting or being applied."""
+        return bool(self._changes) or (self._worker is not None and not self._worker.done())
+
+    def submit(self, client, user_id, kind, change):
+        """Queue `change()` for this lobby and return a future for its result.
+
+        `change` returns (reply, announcement); the future resolves to the
+        reply and the announcement, if any, is posted to the lobby's channel.
+        """
+        self._client = client
+        key = (user_id, kind)
+        future = self._pending.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        self._changes.append((key, change, future))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+        return future
+
+    def spawn(self, coro):
+        """Run a coroutine for this lobby (e.g. a ready check) without awaiting it."""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self):
+        while self._changes:
+            # Let the rest of a burst arrive so it's applied and announced as one pass
+            await asyncio.sleep(0)
+            announcements = []
+            while self._changes:
+                key, change, future = self._changes.popleft()
+                del self._pending[key]
+                try:
+                    reply, announcement = change()
+                except Exception as e:
+                    logging.error(f"Error applying {key[1]} for user {key[0]} in lobby {self.queue_manager.key}: {e}")
+                    future.set_exception(e)
+                    continue
+                self.applied += 1
+                if announcement:
+                    announcements.append(announcement)
+                future.set_result(reply)
+
+            client = self._client
+            for announcement in announcements:
+                self.queue_manager.queue_message(client, self.queue_manager.YOUR_CHANNEL_ID, announcement)
+            if self.on_batch is not None:
+                try:
+                    self.on_batch(client)
+                except Exception as e:
+                    logging.error(f"Error checking queue progress in lobby {self.queue_manager.key}: {e}")
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import logging
+import os
+from utils import atomic_write_json
+from metrics import metrics
+from write_behind import WriteBehind
+
+
+def empty_state(guild_id, channel_id):
+    return {
+        "guild_id": guild_id,
+        "channel_id": channel_id,
+        "keen": {},  # {user_id: [joined_at, flags]} in queue order
+        "potential": set(),
+        "cooldowns": {},  # {user_id: expiry}
+        "rejoins": {},  # {user_id: rejoin deadline}
+        "ready_check": None,  # {"message_id", "keeners", "deadline"} while one is running
+    }
+
+
+def state_from_json(saved):
+    """A lobby state dict from its checkpoint form (see QueueManager.export_state)."""
+    state = empty_state(saved["guild_id"], saved["channel_id"])
+    state["keen"] = {user_id: [joined_at, flags] for user_id, joined_at, flags in saved["keen"]}
+    state["potential"] = set(saved["potential"])
+    state["cooldowns"] = dict(saved["cooldowns"])
+    state["rejoins"] = dict(saved["rejoins"])
+    state["ready_check"] = saved["ready_check"]
+    return state
+
+
+def state_to_json(state):
+    """The checkpoint form of a lobby state dict, e.g. to hand it to another shard group."""
+    return {
+        "guild_id": state["guild_id"],
+        "channel_id": state["channel_id"],
+        "keen": [[user_id, joined_at, flags] for user_id, (joined_at, flags) in state["keen"].items()],
+        "potential": list(state["potential"]),
+        "cooldowns": [[user_id, expiry] for user_id, expiry in state["cooldowns"].items()],
+        "rejoins": [[user_id, deadline] for user_id, deadline in state["rejoins"].items()],
+        "ready_check": state["ready_check"],
+    }
+
+
+def apply_change(state, op, args):
+    """Apply one change log entry to a lobby state dict (see QueueManager.log_change)."""
+    if op == "join":
+        user_id, joined_at, flags = args
+        state["keen"].setdefault(user_id, [joined_at, flags])
+        state["potential"].discard(user_id)
+        state["rejoins"].pop(user_id, None)
+    elif op == "touch":
+        user_id, joined_at, flags = args
+        if user_id in state["keen"]:
+            state["keen"][user_id] = [joined_at, flags]
+    elif op == "leave":
+        state["keen"].pop(args[0], None)
+    elif op == "clear":
+        state["keen"].clear()
+    elif op == "timeout":
+        user_id, rejoin_deadline = args
+        state["keen"].pop(user_id, None)
+        state["rejoins"][user_id] = rejoin_deadline
+    elif op == "rejoin_end":
+        state["rejoins"].pop(args[0], None)
+    elif op == "potential_add":
+        state["potential"].add(args[0])
+    elif op == "potential_remove":
+        state["potential"].discard(args[0])
+    elif op == "cooldown":
+        state["cooldowns"][args[0]] = args[1]
+    elif op == "cooldown_end":
+        state["cooldowns"].pop(args[0], None)
+    elif op == "ready_start":
+        message_id, keeners, deadline = args
+        state["ready_check"] = {"message_id": message_id, "keeners": keeners, "deadline": deadline}
+    elif op == "ready_end":
+        state["ready_check"] = None
+    else:
+        raise ValueError(f"Unknown lobby change {op!r}")
+
+
+class LobbyStateStore(WriteBehind):
+    """Crash-consistent persistence for every lobby's queue state.
+
+    A checkpoint is a JSON snapshot of all lobbies written to a temp file
+    and renamed over `path`. Between checkpoints each change is appended to
+    a small change log (one JSON line per change, written behind in batches
+    from a worker thread). Every entry carries a sequence number and the
+    snapshot records the last one it includes, so recovery is: load the
+    snapshot, replay newer log lines, skip a torn last line. The log is
+    truncated after each checkpoint, so both files stay small.
+
+    Conditional keens are persisted by ConditionalStore and aren't repeated here.
+    """
+
+    flush_label = "lobby_log"
+    description = "lobby change log"
+
+    def __init__(self, path='lobbies.json', log_path='lobbies.log', flush_delay=0.2):
+        super().__init__(flush_delay)
+        self.path = path
+        self.log_path = log_path
+        self.seq = 0  # Sequence number of the last recorded change
+        self._pending = []  # Log lines waiting to be appended
+
+    def record(self, key, op, *args):
+        """Queue a change to one lobby's state for the change log."""
+        self.seq += 1
+        self._pending.append(json.dumps([self.seq, key[0], key[1], op, *args], separators=(',', ':')))
+        self._schedule_flush()
+
+    async def checkpoint(self, lobbies):
+        """Snapshot every lobby and start a fresh change log."""
+        async with self._get_lock():
+            # Built on the loop, so it's consistent with self.seq; queued lines are covered by it
+            snapshot = self.snapshot(lobbies)
+            self._pending = []
+            with metrics.timer("spanner_flush_seconds", store="lobby_checkpoint"):
+                await asyncio.to_thread(self._write_checkpoint, snapshot)
+
+    def checkpoint_sync(self, lobbies):
+        """Snapshot every lobby immediately, e.g. on shutdown."""
+        snapshot = self.snapshot(lobbies)
+        self._pending = []
+        self._write_checkpoint(snapshot)
+
+    def snapshot(self, lobbies):
+        return {"seq": self.seq, "lobbies": [lobby.export_state() for lobby in lobbies]}
+
+    def load(self):
+        """Read the last checkpoint and replay the change log. Returns {(guild_id, channel_id): state}."""
+        states = {}
+        seq = 0
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                seq = data["seq"]
+                for saved in data["lobbies"]:
+                    states[(saved["guild_id"], saved["channel_id"])] = state_from_json(saved)
+            except Exception as e:
+                logging.error(f"Error loading lobby checkpoint: {e}")
+                states, seq = {}, 0
+
+        replayed = 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'r', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    try:
+                        entry_seq, guild_id, channel_id, op, *args = json.loads(line)
+                    except (ValueError, TypeError):
+                        logging.warning(f"Skipping unreadable lobby change: {line.strip()[:80]}")
+                        continue
+                    if entry_seq <= seq:
+                        continue  # Already in the checkpoint
+                    key = (guild_id, channel_id)
+                    state = states.get(key)
+                    if state is None:
+                        state = states[key] = empty_state(guild_id, channel_id)
+                    apply_change(state, op, args)
+                    seq = entry_seq
+                    replayed += 1
+        self.seq = seq
+        logging.info(f"Loaded {len(states)} lobbies from checkpoint, replayed {replayed} changes.")
+        return states
+
+    def _take_pending(self):
+        lines, self._pending = self._pending, []
+        return lines or None
+
+    def _requeue(self, lines):
+        self._pending = lines + self._pending
+
+    def _has_pending(self):
+        return bool(self._pending)
+
+    def _write(self, lines):
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_checkpoint(self, snapshot):
+        atomic_write_json(self.path, snapshot)
+        # Everything in the log is now in the checkpoint; a crash before this truncate is harmless
+        with open(self.log_path, 'w', encoding='utf-8'):
+            pass
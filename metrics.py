@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond handler work up to a full ready check
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 600.0)
+
+
+class Histogram:
+    """Fixed-bucket histogram, rendered as a Prometheus histogram."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile, or None if empty."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """In-process counters, gauges and histograms with a Prometheus text rendering.
+
+    Recording is a dict lookup and an increment, so it is cheap enough for
+    every command, REST call and flush. Gauges are callables read only when
+    the metrics are rendered.
+    """
+
+    def __init__(self):
+        self.counters = {}  # {(name, labels): value}
+        self.histograms = {}  # {(name, labels): Histogram}
+        self.gauges = {}  # {name: callable returning a number or {labels: number}}
+        self.help = {}  # {name: description}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def gauge(self, name, read, text=None):
+        """Register a callable that returns the gauge's current value."""
+        self.gauges[name] = read
+        if text:
+            self.help[name] = text
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe how long the block takes. Adds outcome="error" if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(name, time.perf_counter() - start, outcome="error", **labels)
+            raise
+        self.observe(name, time.perf_counter() - start, outcome="ok", **labels)
+
+    def get_histogram(self, name, **labels):
+        return self.histograms.get(self._key(name, labels))
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(self.counters.items()):
+            declare(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+        for name, read in sorted(self.gauges.items()):
+            try:
+                value = read()
+            except Exception as e:
+                logging.error(f"Error reading gauge {name}: {e}")
+                continue
+            declare(name, "gauge")
+            if isinstance(value, dict):
+                for labels, item in sorted(value.items()):
+                    lines.append(f"{name}{_labels(labels)} {item}")
+            else:
+                lines.append(f"{name} {value}")
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    async def monitor_loop_lag(self, interval=0.5):
+        """Record how late the event loop wakes up from a sleep of `interval` seconds."""
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.observe("spanner_event_loop_lag_seconds", max(0.0, time.perf_counter() - start - interval))
+
+    async def serve(self, host="127.0.0.1", port=9108):
+        """Serve the metrics over HTTP for Prometheus to scrape. Runs until cancelled."""
+        server = await asyncio.start_server(self._handle_http, host, port)
+        logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_http(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass  # Headers aren't needed
+            path = request.split()[1] if len(request.split()) > 1 else b"/"
+            if path in (b"/metrics", b"/"):
+                status, body = "200 OK", self.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logging.error(f"Error serving metrics: {e}")
+        finally:
+            writer.close()
+
+    async def write_periodically(self, path, interval=15):
+        """Write the metrics to `path` every `interval` seconds, replacing the file atomically."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(_write_text, path, self.render())
+            except Exception as e:
+                logging.error(f"Error writing metrics file: {e}")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _write_text(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+# Shared by every module, like the logging root logger
+metrics = Metrics()
+metrics.describe("spanner_command_seconds", "Slash command handling time")
+metrics.describe("spanner_rest_seconds", "Discord REST call time")
+metrics.describe("spanner_ready_check_seconds", "Ready check duration by outcome")
+metrics.describe("spanner_event_loop_lag_seconds", "How late the event loop wakes from a sleep")
+metrics.describe("spanner_flush_seconds", "Persistence flush time by store")
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import discord
+from metrics import metrics
+
+MESSAGE_LIMIT = 2000  # Discord's per-message character limit
+GLOBAL_RATE = 50.0  # Discord's global limit, in requests per second per bot token
+
+
+class TokenBucket:
+    """Token bucket used to pace sends under Discord's rate limits."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate  # Tokens added per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OutboundMessage:
+    __slots__ = ("content", "future", "enqueued", "coalesce")
+
+    def __init__(self, content, future, coalesce):
+        self.content = content
+        self.future = future  # Resolves to the sent discord.Message, or None on failure
+        self.enqueued = time.monotonic()
+        self.coalesce = coalesce  # False if the caller needs a Message of its own
+
+
+class ChannelOutbox:
+    """Pending messages for one channel, drained by a single worker task."""
+
+    def __init__(self, pipeline, channel):
+        self.pipeline = pipeline
+        self.channel = channel
+        self.queue = deque()
+        self.bucket = TokenBucket(rate=pipeline.channel_rate, capacity=pipeline.channel_burst)
+        self._worker = None
+
+    def is_idle(self):
+        """True once everything is sent and the rate limit has fully recovered, so dropping this outbox loses nothing."""
+        if self.queue or (self._worker is not None and not self._worker.done()):
+            return False
+        self.bucket._refill()
+        return self.bucket.tokens >= self.bucket.capacity
+
+    def put(self, message):
+        self.queue.append(message)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while self.queue:
+            # Give messages queued close together a moment to arrive so they go out as one post
+            await asyncio.sleep(self.pipeline.coalesce_window)
+            await self.bucket.acquire()
+            await self.pipeline.global_bucket.acquire()
+            await self._send(self._take_batch())
+
+    def _take_batch(self):
+        batch = [self.queue.popleft()]
+        if not batch[0].coalesce:
+            return batch
+        length = len(batch[0].content)
+        while self.queue and self.queue[0].coalesce:
+            next_length = length + 1 + len(self.queue[0].content)
+            if next_length > MESSAGE_LIMIT:
+                break
+            batch.append(self.queue.popleft())
+            length = next_length
+        return batch
+
+    async def _send(self, batch):
+        content = "\n".join(message.content for message in batch)
+        sent = None
+        try:
+            with metrics.timer("spanner_rest_seconds", call="channel.send"):
+                sent = await self.channel.send(content)
+            if self.pipeline.log_content:
+                logging.info(f"Message sent to channel {self.channel.id}: {content}")
+            else:
+                logging.debug(f"Message sent to channel {self.channel.id} ({len(batch)} queued, {len(content)} chars)")
+        except discord.Forbidden:
+            logging.error(f"ERROR: Bot lacks permissions to send messages in channel {self.channel.id}!")
+        except discord.HTTPException as e:
+            logging.error(f"ERROR: Failed to send message in channel {self.channel.id}: {e}")
+        except Exception as e:
+            # Keep the worker alive so later messages and waiting callers aren't stranded
+            logging.error(f"ERROR: Unexpected error sending to channel {self.channel.id}: {e}")
+
+        now = time.monotonic()
+        for message in batch:
+            self.pipeline.record_latency(now - message.enqueued)
+            if not message.future.done():
+                message.future.set_result(sent)
+        self.pipeline.sent += 1
+        self.pipeline.coalesced += len(batch) - 1
+
+
+class OutboundPipeline:
+    """Per-channel outbound queues that coalesce and pace bot messages.
+
+    Messages queued for the same channel within `coalesce_window` seconds
+    are joined into one post (up to Discord's 2000-character limit), and
+    every post waits for a token from the channel's bucket and the global
+    bucket so bursts don't run into 429s.
+    """
+
+    def __init__(self, coalesce_window=0.25, global_rate=GLOBAL_RATE, channel_rate=1.0, channel_burst=5, log_content=True):
+        self.coalesce_window = coalesce_window
+        self.log_content = log_content  # Log every post's full text at INFO; costly under load
+        # Discord allows roughly 5 messages per 5 seconds in a channel
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.global_bucket = TokenBucket(rate=global_rate, capacity=global_rate)  # Shared by every channel in this process
+        self._outboxes = {}  # {channel_id: ChannelOutbox}
+        self.latencies = deque(maxlen=1000)  # Recent enqueue-to-sent times in seconds
+        self.sent = 0  # Posts made
+        self.coalesced = 0  # Messages that were merged into another post
+        self.resolve_channel = None  # Optional channel_id -> channel lookup used instead of bot.get_channel, e.g. EntityCache.channel
+
+    def send(self, bot, channel_id, content, coalesce=True):
+        """Queue a message for a channel and return a future for the sent Message."""
+        future = asyncio.get_running_loop().create_future()
+        outbox = self._outboxes.get(channel_id)
+        if outbox is None:
+            channel = self.channel(bot, channel_id)
+            if channel is None:
+                logging.error(f"Channel {channel_id} not found!")
+                future.set_result(None)
+                return future
+            outbox = self._outboxes[channel_id] = ChannelOutbox(self, channel)
+        outbox.put(OutboundMessage(content, future, coalesce))
+        return future
+
+    def channel(self, bot, channel_id):
+        """Look a channel up the way every bot message does: through `resolve_channel` if set."""
+        return self.resolve_channel(channel_id) if self.resolve_channel else bot.get_channel(channel_id)
+
+    def evict_idle(self):
+        """Drop outboxes with nothing queued and a full bucket, so their channels aren't held forever. Returns how many went."""
+        idle = [channel_id for channel_id, outbox in self._outboxes.items() if outbox.is_idle()]
+        for channel_id in idle:
+            del self._outboxes[channel_id]
+        return len(idle)
+
+    def queue_depth(self, channel_id=None):
+        """Messages waiting to be sent, for one channel or all of them."""
+        if channel_id is not None:
+            outbox = self._outboxes.get(channel_id)
+            return len(outbox.queue) if outbox else 0
+        return sum(len(outbox.queue) for outbox in self._outboxes.values())
+
+    def record_latency(self, seconds):
+        self.latencies.append(seconds)
+
+    def stats(self):
+        """Queue depth, post counts and recent send latency percentiles."""
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "queue_depth": self.queue_depth(),
+            "channels": len(self._outboxes),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "latency_p50": percentile(0.50),
+            "latency_p95": percentile(0.95),
+        }
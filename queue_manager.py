@@ -1,11 +1,18 @@
 import discord
-import csv
 import os
 import time
 from collections import Counter
 import logging
-import asyncio
 from dotenv import load_dotenv  # Import load_dotenv
+from spanners import SpannerTracker
+from spanner_store import REASON_UNKEEN
+from scheduler import DeadlineScheduler
+from reaction_router import ReactionRouter
+from outbound import OutboundPipeline
+from conditional_store import ConditionalStore
+from keen_queue import KeenQueue, FLAG_REJOINED
+from lobby_actor import LobbyActor
+from utils import mention
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -14,16 +21,44 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 load_dotenv("token.env")
 
 class QueueManager:
-    def __init__(self):
-        self.keen_queue = {}  # {user_mention: join_timestamp}
-        self.potential_queue = set()  # Track users who are potentially keen
-        self.conditional_queue = {}  # {user_mention: expiry_timestamp}
-        self.unkeen_cooldown = {}
-        self.spanner_tracker = []
+    """Queue state for one lobby (a guild channel).
+
+    The scheduler, reaction router, outbound pipeline, spanner tracker and
+    conditional store are shared between lobbies when passed in by a
+    LobbyRegistry; a standalone QueueManager creates its own.
+    """
+
+    def __init__(self, guild_id=None, channel_id=None, scheduler=None, reaction_router=None,
+                 outbound=None, spanners=None, conditional_store=None, changes=None):
+        self.guild_id = guild_id
+        self.key = (guild_id, channel_id)  # Lobby key, also namespaces this lobby's scheduler jobs
+        self.keen_queue = KeenQueue()  # user IDs in queue order, with join times and flags
+        self.potential_queue = set()  # IDs of users who are potentially keen
+        self.conditional_queue = {}  # {user_id: {"deadline": timestamp, "message_id": check-in message or None}}
+        self.CONDITIONAL_RESPONSE_TIMEOUT = 300  # Users get 5 minutes to answer a check-in
+        self.unkeen_cooldown = {}  # {user_id: cooldown_expiry_timestamp}
         self.QUEUE_LIMIT = 5
         self.USER_TIMEOUT = 3600  # Auto-remove users after 1 hour
-        self.YOUR_CHANNEL_ID = int(os.getenv("PRIVATE_CHANNEL_ID"))  # Load private channel ID from .env
+        self.REJOIN_WINDOW = 600  # Timed-out users are re-added after 10 minutes if there's room
+        self.UNKEEN_COOLDOWN = 300  # Users can't /unkeen again for 5 minutes
+        self.READY_CHECK_TIMEOUT = 600  # Users get 10 minutes to ready up
+        if channel_id is not None:
+            self.YOUR_CHANNEL_ID = channel_id
+        else:
+            self.YOUR_CHANNEL_ID = int(os.getenv("PRIVATE_CHANNEL_ID", 0))  # Load private channel ID from .env
         self.ready_check_active = False  # Flag to track if a ready check is active
+        self.ready_check = None  # {"message_id", "keeners", "deadline"} once the ready check message is up
+        self.changes = changes  # Optional LobbyStateStore that logs every queue change
+        self.actor = LobbyActor(self)  # Applies command changes to the queues one at a time, in order
+        self.last_active = time.time()  # Used by LobbyRegistry to evict idle lobbies
+        self.scheduler = scheduler if scheduler is not None else DeadlineScheduler()  # Timeouts, rejoin windows, cooldowns and check-ins
+        self.reaction_router = reaction_router if reaction_router is not None else ReactionRouter()  # Ready checks and check-ins waiting on reactions
+        self.outbound = outbound if outbound is not None else OutboundPipeline()  # Paced, coalescing per-channel message queues
+        self.spanners = spanners if spanners is not None else SpannerTracker()
+        self.conditional_store = conditional_store if conditional_store is not None else ConditionalStore()
+        self.conditional_store.attach(self.key, self.conditional_queue)
+        self._job_keys = set()  # Scheduler keys this lobby has handed out
+        self.bot = None  # Set once the timeout checker starts
 
     async def set_channel_id(self, bot):
         """Dynamically set the channel ID for notifications."""
@@ -55,62 +90,197 @@ class QueueManager:
         
         logging.error("ERROR: Could not find a valid channel for YOUR_CHANNEL_ID!")
 
-    def save_spanner_tracker(self):
-        """Save the spanner tracker data to a CSV file."""
-        try:
-            with open('spanner_tracker.csv', 'w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(['User ID', 'Mention'])
-                for user_id, mention in self.spanner_tracker:
-                    writer.writerow([user_id, mention])
-        except Exception as e:
-            logging.error(f"Error saving spanner tracker: {e}")
-
-    def load_spanner_tracker(self):
-        """Load the spanner tracker data from a CSV file."""
-        if os.path.exists('spanner_tracker.csv'):
-            try:
-                with open('spanner_tracker.csv', 'r', newline='', encoding='utf-8') as csvfile:
-                    reader = csv.reader(csvfile)
-                    next(reader)  # Skip header
-                    self.spanner_tracker = [(int(row[0]), row[1]) for row in reader]
-            except Exception as e:
-                logging.error(f"Error loading spanner tracker: {e}")
-
-    async def check_queue_timeouts(self, bot):
-        """Automatically remove inactive users from the queue."""
-        while True:
-            if self.YOUR_CHANNEL_ID is None:
-                logging.info("YOUR_CHANNEL_ID not set. Retrying in 10 seconds...")
-                await asyncio.sleep(10)
-                continue
-            
-            await asyncio.sleep(60)  # Check every minute
-            now = time.time()
-            expired_users = [user for user, join_time in self.keen_queue.items() if now - join_time > self.USER_TIMEOUT and not self.ready_check_active]
-            
-            for user in expired_users:
-                del self.keen_queue[user]
-                await self.send_message_to_channel(bot, self.YOUR_CHANNEL_ID, f"{user} removed from the queue due to timeout. You have 10 minutes to rejoin at your original position!")
-                
-                # Rejoin logic
-                await asyncio.sleep(600)  # 10-minute window
-                if user not in self.keen_queue and len(self.keen_queue) < self.QUEUE_LIMIT:
-                    self.keen_queue[user] = time.time()
-                    await self.send_message_to_channel(bot, self.YOUR_CHANNEL_ID, f"{user} has rejoined the queue at their original position!")
-
-    async def send_message_to_channel(self, bot, channel_id, message_content):
-        """Helper function to send messages to a channel and return the message object."""
-        channel = bot.get_channel(channel_id)
-        if channel:
-            try:
-                message = await channel.send(message_content)
-                logging.info(f"Message sent to channel {channel_id}: {message_content}")
-                return message  # Return the message object
-            except discord.Forbidden:
-                logging.error(f"ERROR: Bot lacks permissions to send messages in channel {channel_id}!")
-            except discord.HTTPException as e:
-                logging.error(f"ERROR: Failed to send message in channel {channel_id}: {e}")
+    def record_spanner(self, user_id, mention, reason=REASON_UNKEEN):
+        """Record a spanner in the shared tracker, tagged with this lobby's guild."""
+        self.spanners.record(user_id, mention, reason, self.guild_id)
+
+    def schedule_job(self, kind, ident, deadline, callback, *args):
+        """Schedule a job on the (possibly shared) scheduler under this lobby's namespace."""
+        key = (self.key, kind, ident)
+        self._job_keys.add(key)
+        self.scheduler.schedule(key, deadline, callback, *args)
+
+    def cancel_job(self, kind, ident):
+        key = (self.key, kind, ident)
+        self._job_keys.discard(key)
+        return self.scheduler.cancel(key)
+
+    def has_job(self, kind, ident):
+        return (self.key, kind, ident) in self.scheduler
+
+    def has_pending_jobs(self):
+        """True if any of this lobby's scheduler jobs hasn't fired yet."""
+        self._job_keys = {key for key in self._job_keys if key in self.scheduler}
+        return bool(self._job_keys)
+
+    def is_idle(self):
+        """True if the lobby holds no state worth keeping in memory."""
+        return not (
+            self.keen_queue or self.potential_queue or self.conditional_queue or self.unkeen_cooldown
+            or self.ready_check_active or self.actor.busy() or self.has_pending_jobs()
+        )
+
+    def add_conditional(self, user_id, deadline):
+        """Persist a conditional keen that should be checked in on at `deadline`."""
+        self.conditional_queue[user_id] = {"deadline": deadline, "message_id": None}
+        self.conditional_store.save()
+
+    def set_conditional_message(self, user_id, message_id, deadline):
+        """Record the check-in message a conditional keener has until `deadline` to answer."""
+        self.conditional_queue[user_id] = {"deadline": deadline, "message_id": message_id}
+        self.conditional_store.save()
+
+    def remove_conditional(self, user_id):
+        """Drop a conditional keen and cancel its scheduled job."""
+        entry = self.conditional_queue.pop(user_id, None)
+        if entry is None:
+            return False
+        if entry["message_id"] is not None:
+            self.reaction_router.unregister(entry["message_id"])
+        self.cancel_job("conditional", user_id)
+        self.conditional_store.save()
+        return True
+
+    def load_conditional_queue(self):
+        """Load this lobby's pending conditional keens saved by a previous run."""
+        self.conditional_queue.update(self.conditional_store.load().get(self.key, {}))
+
+    def log_change(self, op, *args):
+        """Record a queue change in the change log, if this lobby has one."""
+        if self.changes is not None:
+            self.changes.record(self.key, op, *args)
+
+    def add_to_queue(self, user_id, flags=0):
+        """Add a user to the keen queue, schedule their timeout and return their position."""
+        now = time.time()
+        entry = self.keen_queue.touch(user_id, now, flags)
+        if entry is not None:
+            # Already queued, e.g. readied up in a ready check that didn't fill: same place, fresh timeout
+            self.log_change("touch", user_id, now, entry.flags)
+            position = self.keen_queue.position(user_id)
         else:
-            logging.error(f"Channel {channel_id} not found!")
-        return None  # Return None if the message couldn't be sent
\ No newline at end of file
+            position = self.keen_queue.add(user_id, now, flags)
+            self.potential_queue.discard(user_id)  # As replaying the join does
+            self.log_change("join", user_id, now, flags)
+        self.cancel_job("rejoin", user_id)
+        self.schedule_job("timeout", user_id, now + self.USER_TIMEOUT, self._on_queue_timeout, user_id)
+        return position
+
+    def remove_from_queue(self, user_id):
+        """Remove a user from the keen queue and cancel their timeout."""
+        if self.keen_queue.remove(user_id) is not None:
+            self.log_change("leave", user_id)
+        self.cancel_job("timeout", user_id)
+
+    def clear_queue(self):
+        """Empty the keen queue and cancel every pending timeout."""
+        for user_id in self.keen_queue:
+            self.cancel_job("timeout", user_id)
+        self.keen_queue.clear()
+        self.log_change("clear")
+
+    def add_potential(self, user_id):
+        self.potential_queue.add(user_id)
+        self.log_change("potential_add", user_id)
+
+    def remove_potential(self, user_id):
+        self.potential_queue.discard(user_id)
+        self.log_change("potential_remove", user_id)
+
+    def start_ready_check(self, message_id, keeners, deadline):
+        """Remember the running ready check so a restart can pick it up."""
+        self.ready_check = {"message_id": message_id, "keeners": list(keeners), "deadline": deadline}
+        self.log_change("ready_start", message_id, list(keeners), deadline)
+
+    def end_ready_check(self):
+        self.ready_check_active = False
+        if self.ready_check is not None:
+            self.ready_check = None
+            self.log_change("ready_end")
+
+    def start_unkeen_cooldown(self, user_id):
+        """Put a user on the /unkeen cooldown and schedule its expiry."""
+        expiry = time.time() + self.UNKEEN_COOLDOWN
+        self.unkeen_cooldown[user_id] = expiry
+        self.schedule_job("cooldown", user_id, expiry, self._on_cooldown_expired, user_id)
+        self.log_change("cooldown", user_id, expiry)
+
+    async def _on_cooldown_expired(self, user_id):
+        if self.unkeen_cooldown.pop(user_id, None) is not None:
+            self.log_change("cooldown_end", user_id)
+
+    async def _on_queue_timeout(self, user_id):
+        if user_id not in self.keen_queue:
+            return
+        if self.ready_check_active:
+            # Don't pull people out mid ready check, look again in a minute
+            self.schedule_job("timeout", user_id, time.time() + 60, self._on_queue_timeout, user_id)
+            return
+
+        self.keen_queue.remove(user_id)
+        self.queue_message(self.bot, self.YOUR_CHANNEL_ID, f"{mention(user_id)} removed from the queue due to timeout. You have 10 minutes to rejoin at your original position!")
+        rejoin_deadline = time.time() + self.REJOIN_WINDOW
+        self.schedule_job("rejoin", user_id, rejoin_deadline, self._on_rejoin_window, user_id)
+        self.log_change("timeout", user_id, rejoin_deadline)
+
+    async def _on_rejoin_window(self, user_id):
+        if self.ready_check_active and user_id not in self.keen_queue:
+            # Nobody joins mid ready check, look again in a minute
+            self.schedule_job("rejoin", user_id, time.time() + 60, self._on_rejoin_window, user_id)
+            return
+        if user_id not in self.keen_queue and len(self.keen_queue) < self.QUEUE_LIMIT:
+            self.add_to_queue(user_id, FLAG_REJOINED)  # Logged as a join, which ends the rejoin window
+            self.queue_message(self.bot, self.YOUR_CHANNEL_ID, f"{mention(user_id)} has rejoined the queue at their original position!")
+            # Same follow-up as a command pass, so a rejoin that fills the queue starts the ready check
+            if self.actor.on_batch is not None:
+                self.actor.on_batch(self.bot)
+        else:
+            self.log_change("rejoin_end", user_id)
+
+    def export_state(self):
+        """This lobby's queue state as JSON-ready data, for LobbyStateStore checkpoints."""
+        rejoins = [[key[2], self.scheduler.deadline(key)] for key in self._job_keys if key[1] == "rejoin" and key in self.scheduler]
+        return {
+            "guild_id": self.key[0],
+            "channel_id": self.key[1],
+            "keen": [[user_id, entry.joined_at, entry.flags] for user_id, entry in self.keen_queue.items()],
+            "potential": list(self.potential_queue),
+            "cooldowns": [[user_id, expiry] for user_id, expiry in self.unkeen_cooldown.items()],
+            "rejoins": rejoins,
+            "ready_check": self.ready_check,
+        }
+
+    def restore_state(self, state, now=None):
+        """Rebuild queues, cooldowns and their scheduled jobs from a loaded state.
+
+        Queue order and join times are kept, so timeouts fire when they
+        originally would have (straight away if they're overdue). A ready
+        check that was running is left in `ready_check` for the caller to
+        resolve or restart; until then the lobby counts as mid ready check.
+        """
+        now = now or time.time()
+        for user_id, (joined_at, flags) in state["keen"].items():
+            self.keen_queue.add(user_id, joined_at, flags)
+            self.schedule_job("timeout", user_id, joined_at + self.USER_TIMEOUT, self._on_queue_timeout, user_id)
+        self.potential_queue.update(state["potential"])
+        for user_id, expiry in state["cooldowns"].items():
+            if expiry > now:
+                self.unkeen_cooldown[user_id] = expiry
+                self.schedule_job("cooldown", user_id, expiry, self._on_cooldown_expired, user_id)
+        for user_id, deadline in state["rejoins"].items():
+            if user_id not in self.keen_queue:
+                self.schedule_job("rejoin", user_id, deadline, self._on_rejoin_window, user_id)
+        self.ready_check = state["ready_check"]
+        self.ready_check_active = self.ready_check is not None
+
+    async def send_message_to_channel(self, bot, channel_id, message_content, coalesce=True):
+        """Send a message through the channel's outbound queue and return the message object.
+
+        Pass coalesce=False when the caller needs a message of its own, e.g. to add reactions.
+        Returns None if the message couldn't be sent.
+        """
+        return await self.outbound.send(bot, channel_id, message_content, coalesce)
+
+    def queue_message(self, bot, channel_id, message_content):
+        """Queue a message without waiting for it to be sent. Returns a future for the message."""
+        return self.outbound.send(bot, channel_id, message_content)
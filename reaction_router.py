@@ -0,0 +1,77 @@
+import asyncio
+import logging
+
+
+class PendingVote:
+    """Reactions a bot message is waiting for from a fixed set of users."""
+
+    def __init__(self, voters, emojis, on_vote=None):
+        self.voters = set(voters)  # User IDs allowed to vote
+        self.emojis = set(emojis)  # Emojis that count as a vote
+        self.votes = {}  # {user_id: emoji}
+        self.on_vote = on_vote  # Optional coroutine called as on_vote(user_id, emoji)
+        self._complete = asyncio.Event()
+        if not self.voters:
+            self._complete.set()
+
+    def add(self, user_id, emoji):
+        """Record a vote. Returns False if the reaction doesn't count."""
+        if user_id not in self.voters or emoji not in self.emojis or user_id in self.votes:
+            return False
+        self.votes[user_id] = emoji
+        if len(self.votes) >= len(self.voters):
+            self._complete.set()
+        return True
+
+    def withdraw(self, user_id):
+        """Stop waiting on a user, e.g. one who left the queue mid ready check."""
+        self.voters.discard(user_id)
+        self.votes.pop(user_id, None)
+        if len(self.votes) >= len(self.voters):
+            self._complete.set()
+
+    async def wait(self, timeout):
+        """Wait until everyone has voted. Returns False on timeout."""
+        try:
+            await asyncio.wait_for(self._complete.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class ReactionRouter:
+    """Routes raw reaction events to the pending vote on their message.
+
+    One `on_raw_reaction_add` listener looks the message ID up in a dict, so
+    each reaction costs O(1) no matter how many ready checks and check-ins
+    are waiting, and reactions on uncached messages still count.
+    """
+
+    def __init__(self):
+        self._votes = {}  # {message_id: PendingVote}
+
+    def __len__(self):
+        return len(self._votes)
+
+    def register(self, message_id, vote):
+        self._votes[message_id] = vote
+        return vote
+
+    def get(self, message_id):
+        return self._votes.get(message_id)
+
+    def unregister(self, message_id):
+        return self._votes.pop(message_id, None)
+
+    async def dispatch(self, payload):
+        """Apply a RawReactionActionEvent to the vote waiting on its message, if any."""
+        vote = self._votes.get(payload.message_id)
+        if vote is None:
+            return
+        emoji = str(payload.emoji)
+        if not vote.add(payload.user_id, emoji) or vote.on_vote is None:
+            return
+        try:
+            await vote.on_vote(payload.user_id, emoji)
+        except Exception as e:
+            logging.error(f"Error handling reaction on message {payload.message_id}: {e}")
@@ -0,0 +1,101 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+
+class DeadlineScheduler:
+    """Single-task deadline scheduler backed by a min-heap.
+
+    Jobs are identified by a hashable key such as ("timeout", user) so they
+    can be rescheduled or cancelled without knowing their deadline. One
+    `run()` task sleeps until the earliest deadline and fires each job's
+    coroutine callback as its own task, so a slow job never delays the rest.
+    Cancelled jobs are left in the heap and skipped when popped; the heap is
+    rebuilt once they outnumber the live ones.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._heap = []  # [(deadline, seq, key)]
+        self._jobs = {}  # {key: (deadline, seq, callback, args)}
+        self._seq = itertools.count()
+        self._stale = 0  # Heap entries whose job was cancelled or rescheduled
+        self._wakeup = None
+        self._tasks = set()  # Keep references to running callbacks
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __contains__(self, key):
+        return key in self._jobs
+
+    def deadline(self, key):
+        """Return the deadline of a scheduled job, or None."""
+        job = self._jobs.get(key)
+        return job[0] if job else None
+
+    def schedule(self, key, deadline, callback, *args):
+        """Run `await callback(*args)` at `deadline`, replacing any job with the same key."""
+        if key in self._jobs:
+            self._stale += 1
+        seq = next(self._seq)
+        self._jobs[key] = (deadline, seq, callback, args)
+        heapq.heappush(self._heap, (deadline, seq, key))
+        if self._heap[0][1] == seq and self._wakeup is not None:
+            self._wakeup.set()  # New earliest deadline, let run() re-arm its sleep
+
+    def cancel(self, key):
+        """Cancel a scheduled job. Returns True if it was pending."""
+        if self._jobs.pop(key, None) is None:
+            return False
+        self._stale += 1
+        if self._stale > 64 and self._stale > len(self._jobs):
+            self._compact()
+        return True
+
+    def _compact(self):
+        self._heap = [(deadline, seq, key) for key, (deadline, seq, _, _) in self._jobs.items()]
+        heapq.heapify(self._heap)
+        self._stale = 0
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, seq, key = heapq.heappop(self._heap)
+            job = self._jobs.get(key)
+            if job is None or job[1] != seq:
+                self._stale = max(0, self._stale - 1)
+                continue
+            del self._jobs[key]
+            due.append((key, job[2], job[3]))
+        return due
+
+    def _fire(self, key, callback, args):
+        task = asyncio.create_task(callback(*args))
+        self._tasks.add(task)
+        task.add_done_callback(lambda t: self._job_done(key, t))
+
+    def _job_done(self, key, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Scheduled job {key} failed: {task.exception()!r}")
+
+    async def run(self):
+        """Fire jobs at their deadlines until cancelled."""
+        self._wakeup = asyncio.Event()
+        while True:
+            for key, callback, args in self._pop_due(self.clock()):
+                self._fire(key, callback, args)
+
+            self._wakeup.clear()
+            timeout = None
+            if self._heap:
+                timeout = max(0, self._heap[0][0] - self.clock())
+            # asyncio.wait rather than wait_for, which can swallow a cancel that lands as the timeout expires
+            waiter = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait({waiter}, timeout=timeout)
+            finally:
+                waiter.cancel()
@@ -0,0 +1,218 @@
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import os
+import re
+import time
+
+IDENTIFY_INTERVAL = 5.0  # Discord allows one IDENTIFY per 5 seconds per max_concurrency bucket
+
+
+def shard_for_guild(guild_id, shard_count):
+    """The shard Discord routes a guild's events to."""
+    if guild_id is None:
+        return 0  # DMs always arrive on shard 0
+    return (guild_id >> 22) % shard_count
+
+
+def shard_groups(shard_count, group_count):
+    """Split shard IDs into `group_count` contiguous groups, one per process."""
+    size, extra = divmod(shard_count, group_count)
+    groups = []
+    start = 0
+    for group in range(group_count):
+        end = start + size + (1 if group < extra else 0)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+
+def group_path(path, group):
+    """`path` with a shard group's suffix, or as it is for group None."""
+    if group is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.group-{group}{ext}"
+
+
+class ShardPlan:
+    """Which shards this process runs and which guilds, and so which lobbies, it owns.
+
+    Discord delivers every event for a guild, interactions and reactions
+    included, to the connection for that guild's shard. So a process that
+    owns a group of shards sees exactly the lobbies in those shards' guilds,
+    and their QueueManagers live only there. Per-lobby files get a
+    per-group suffix; the spanner store is shared by every process.
+    """
+
+    def __init__(self, shard_count=None, group_count=1, group_index=0):
+        self.shard_count = shard_count  # None lets AutoShardedBot ask Discord
+        self.group_count = group_count
+        self.group_index = group_index
+        if shard_count is not None:
+            self.shard_ids = shard_groups(shard_count, group_count)[group_index]
+        else:
+            self.shard_ids = None
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        """SHARD_COUNT, SHARD_GROUPS and SHARD_GROUP, as set by launcher.py."""
+        shard_count = int(environ["SHARD_COUNT"]) if environ.get("SHARD_COUNT") else None
+        return cls(shard_count, int(environ.get("SHARD_GROUPS", 1)), int(environ.get("SHARD_GROUP", 0)))
+
+    @property
+    def sharded(self):
+        return self.shard_count is not None
+
+    @property
+    def is_primary(self):
+        """The first group does once-per-bot work such as syncing commands."""
+        return self.group_index == 0
+
+    def owns_guild(self, guild_id):
+        if self.shard_ids is None:
+            return True
+        return shard_for_guild(guild_id, self.shard_count) in self.shard_ids
+
+    def group_for_guild(self, guild_id):
+        """The group whose shards include a guild."""
+        if self.shard_ids is None:
+            return self.group_index
+        shard = shard_for_guild(guild_id, self.shard_count)
+        for group, shard_ids in enumerate(shard_groups(self.shard_count, self.group_count)):
+            if shard in shard_ids:
+                return group
+
+    def path(self, path, group=None):
+        """Give a per-process file its group suffix, e.g. lobbies.json -> lobbies.group-1.json.
+
+        Defaults to this process's group; pass `group` for another one's file.
+        """
+        if self.group_count == 1:
+            return path
+        return group_path(path, self.group_index if group is None else group)
+
+    def stale_groups(self, path):
+        """Groups with a `path` file on disk from a different number of groups (None for the unsuffixed file)."""
+        root, ext = os.path.splitext(path)
+        pattern = re.compile(re.escape(root) + r"\.group-(\d+)" + re.escape(ext))
+        matches = (pattern.fullmatch(found) for found in glob.glob(f"{glob.escape(root)}.group-*{ext}"))
+        stale = sorted(int(match.group(1)) for match in matches if match)
+        if self.group_count > 1:
+            stale = [group for group in stale if group >= self.group_count]
+            if os.path.exists(path):
+                stale.insert(0, None)
+        return stale
+
+    def bot_options(self):
+        """Extra keyword arguments for commands.AutoShardedBot."""
+        return {"shard_count": self.shard_count, "shard_ids": self.shard_ids}
+
+
+class LocalCoordinator:
+    """Local stand-in for a shard coordinator: spaces out IDENTIFYs across processes.
+
+    Every process on the machine takes an exclusive lock on `path` before
+    identifying a shard and records the time in the file, so shards in
+    different processes identify at least `interval` seconds apart. A
+    multi-machine deployment would swap this for a shared service.
+    """
+
+    def __init__(self, path='identify.lock', interval=IDENTIFY_INTERVAL):
+        self.path = path
+        self.interval = interval
+
+    async def identify(self, shard_id):
+        """Wait for this shard's turn to identify."""
+        waited = await asyncio.to_thread(self._wait_turn)
+        if waited:
+            logging.info(f"Shard {shard_id} waited {waited:.1f}s for its turn to identify.")
+
+    def _wait_turn(self):
+        with open(self.path, 'a+', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                last = float(f.read().strip() or 0)
+                wait = max(0.0, last + self.interval - time.time())
+                if wait:
+                    time.sleep(wait)
+                f.seek(0)
+                f.truncate()
+                f.write(str(time.time()))
+                f.flush()
+                return wait
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class Inbox:
+    """Lobby state handed over to a shard group by another one, e.g. after a re-shard.
+
+    Senders append JSON lines under an exclusive lock on `path`, so any
+    number of processes can post to the same group. The owner reads what's
+    there, makes it durable in its own files, then discards just the part
+    it read, keeping anything posted in between.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def post(self, entries):
+        """Append entries for the owning group and sync them to disk."""
+        if not entries:
+            return
+        lines = "".join(json.dumps(entry, separators=(',', ':')) + "\n" for entry in entries)
+        with open(self.path, 'a+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # Start on a fresh line if a sender crashed mid-write, so only its line is lost
+                end = f.seek(0, os.SEEK_END)
+                if end:
+                    f.seek(end - 1)
+                    if f.read(1) != b"\n":
+                        lines = "\n" + lines
+                f.write(lines.encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read(self):
+        """Everything posted so far, and how many bytes it took up (for `discard`)."""
+        if not os.path.exists(self.path):
+            return [], 0
+        with open(self.path, 'rb') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                data = f.read()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        # Senders hold the lock until their lines are complete, so a partial line means one crashed
+        size = data.rfind(b"\n") + 1
+        entries = []
+        for line in data[:size].decode('utf-8', errors='replace').splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                logging.warning(f"Skipping unreadable handed-over lobby state: {line.strip()[:80]}")
+        return entries, size
+
+    def discard(self, size):
+        """Drop the first `size` bytes, which the owner has now saved in its own files."""
+        if not size:
+            return
+        with open(self.path, 'r+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(size)
+                rest = f.read()
+                f.seek(0)
+                f.write(rest)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
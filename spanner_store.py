@@ -0,0 +1,262 @@
+import asyncio
+import csv
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from write_behind import WriteBehind
+
+# Spanner reasons
+REASON_UNKEEN = "unkeen"
+REASON_READY_CHECK = "ready_check_timeout"
+REASON_CONDITIONAL_DECLINE = "conditional_decline"
+REASON_CONDITIONAL_NO_RESPONSE = "conditional_no_response"
+REASON_IMPORTED = "imported"  # From spanner_tracker.csv, which kept no reason or time
+
+HEADER = ['User ID', 'Mention']  # First line of the legacy spanner_tracker.csv
+DECAY_EPOCH = 1_700_000_000  # Reference time for decay weights; any fixed past time works
+IMPORT_BATCH = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spanner_events (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    guild_id INTEGER,
+    reason TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS spanner_events_by_time ON spanner_events (created_at, user_id);
+CREATE INDEX IF NOT EXISTS spanner_events_by_user ON spanner_events (user_id, created_at);
+CREATE TABLE IF NOT EXISTS spanner_scores (
+    user_id INTEGER PRIMARY KEY,
+    mention TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    weight REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS spanner_scores_by_weight ON spanner_scores (weight);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def parse_tracker_row(row):
+    """(user_id, mention) from a spanner_tracker.csv row, or None if it's malformed."""
+    if len(row) != 2 or not row[0].isdigit() or not row[1].endswith('>'):
+        return None
+    return int(row[0]), row[1]
+
+
+class SpannerStore(WriteBehind):
+    """Spanner events in SQLite, with time, reason and guild.
+
+    Every event is a row indexed by time and by user, so windowed counts
+    ("last 7 days") and per-user history are index range scans rather than
+    a pass over all history. `spanner_scores` keeps one row per user with
+    their all-time total and a decay weight: each event adds
+    2 ** ((created_at - DECAY_EPOCH) / half_life), so ordering by weight is
+    ordering by decayed score, and the score itself is the weight scaled by
+    2 ** (-(now - DECAY_EPOCH) / half_life).
+
+    Events are written behind in batches from a worker thread; the
+    connection is guarded by a lock so queries can run in threads too.
+    """
+
+    flush_label = "spanner_db"
+    description = "spanner events"
+
+    def __init__(self, path='spanners.db', half_life_days=14, flush_delay=0.5):
+        super().__init__(flush_delay)
+        self.path = path
+        self.half_life = half_life_days * 86400
+        self._pending = []  # (user_id, mention, guild_id, reason, created_at)
+        self._clear = False  # Delete everything before writing _pending
+        self._db_lock = threading.Lock()
+        self._db = None  # Opened on first use
+
+    def add(self, user_id, mention, reason, guild_id=None, created_at=None):
+        """Queue a spanner event to be written."""
+        self._pending.append((user_id, mention, guild_id, reason, created_at if created_at is not None else time.time()))
+        self._schedule_flush()
+
+    def clear(self):
+        """Queue deleting every event and score."""
+        self._pending = []
+        self._clear = True
+        self._schedule_flush()
+
+    async def fetch(self, query, *args):
+        """Flush, then run one of the query methods in a worker thread."""
+        await self.flush()
+        return await asyncio.to_thread(query, *args)
+
+    async def fetch_unwritten(self, query, *args):
+        """Like fetch(), but also return what the result leaves out: (result, unwritten events, cleared).
+
+        No flush runs while the query does, so events added in the meantime
+        are still queued afterwards and are exactly the ones it didn't see.
+        """
+        async with self._get_lock():
+            await self._flush_locked()
+            result = await asyncio.to_thread(query, *args)
+            return result, list(self._pending), self._clear
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    # Queries. These read the database directly, so call flush() (or use fetch()) first.
+
+    def totals(self):
+        """[(user_id, mention, total)] for every user with a spanner."""
+        return self._query("SELECT user_id, mention, total FROM spanner_scores")
+
+    def counts_since(self, since, guild_id=None, limit=20, offset=0):
+        """[(user_id, mention, count)] of spanners since `since`, most first."""
+        guild_filter = "AND e.guild_id = ?" if guild_id is not None else ""
+        params = [since] + ([guild_id] if guild_id is not None else []) + [limit, offset]
+        return self._query(
+            f"""SELECT e.user_id, s.mention, COUNT(*) AS n
+                FROM spanner_events e JOIN spanner_scores s ON s.user_id = e.user_id
+                WHERE e.created_at >= ? {guild_filter}
+                GROUP BY e.user_id ORDER BY n DESC, e.user_id LIMIT ? OFFSET ?""",
+            params,
+        )
+
+    def decayed_scores(self, now=None, limit=20, offset=0):
+        """[(user_id, mention, score)] by exponentially decayed score, highest first."""
+        scale = self._decay(now or time.time())
+        rows = self._query(
+            "SELECT user_id, mention, weight FROM spanner_scores WHERE weight > 0 ORDER BY weight DESC, user_id LIMIT ? OFFSET ?",
+            (limit, offset),
+        )
+        return [(user_id, mention, weight * scale) for user_id, mention, weight in rows]
+
+    def decayed_score(self, user_id, now=None):
+        rows = self._query("SELECT weight FROM spanner_scores WHERE user_id = ?", (user_id,))
+        return rows[0][0] * self._decay(now or time.time()) if rows else 0.0
+
+    def count_since(self, user_id, since):
+        return self._query("SELECT COUNT(*) FROM spanner_events WHERE user_id = ? AND created_at >= ?", (user_id, since))[0][0]
+
+    def history(self, user_id, limit=10):
+        """[(created_at, reason, guild_id)] for a user's most recent spanners."""
+        return self._query(
+            "SELECT created_at, reason, guild_id FROM spanner_events WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+            (user_id, limit),
+        )
+
+    def import_csv(self, csv_path):
+        """One-time streaming import of a spanner_tracker.csv. Returns how many events were imported.
+
+        The CSV never recorded when or why someone spannered, so imported
+        events get reason "imported" and a time of 0: they count towards
+        all-time totals but not towards windows or decayed scores.
+        """
+        if not os.path.exists(csv_path):
+            return 0
+        with self._db_lock:
+            db = self._connect()
+            if db.execute("SELECT 1 FROM meta WHERE key = 'csv_imported'").fetchone():
+                return 0
+            imported = 0
+            with db:
+                batch = []
+                with open(csv_path, 'r', newline='', encoding='utf-8', errors='replace') as f:
+                    for line_number, row in enumerate(csv.reader(f)):
+                        if line_number == 0 and row == HEADER:
+                            continue
+                        record = parse_tracker_row(row)
+                        if record is None:
+                            logging.warning(f"Skipping malformed spanner tracker line {line_number + 1}: {row}")
+                            continue
+                        batch.append((record[0], record[1], None, REASON_IMPORTED, 0.0))
+                        if len(batch) >= IMPORT_BATCH:
+                            self._insert(db, batch)
+                            imported += len(batch)
+                            batch = []
+                self._insert(db, batch)
+                imported += len(batch)
+                db.execute("INSERT INTO meta (key, value) VALUES ('csv_imported', ?)", (str(time.time()),))
+        logging.info(f"Imported {imported} spanners from {csv_path}.")
+        return imported
+
+    # Internals
+
+    def _decay(self, now):
+        return 2 ** (-(now - DECAY_EPOCH) / self.half_life)
+
+    def _weight(self, created_at):
+        exponent = (created_at - DECAY_EPOCH) / self.half_life
+        return 2 ** exponent if exponent > -1000 else 0.0
+
+    def _take_pending(self):
+        if not self._pending and not self._clear:
+            return None
+        rows, clear = self._pending, self._clear
+        self._pending, self._clear = [], False
+        return rows, clear
+
+    def _requeue(self, batch):
+        rows, clear = batch
+        self._clear = self._clear or clear
+        self._pending = rows + self._pending
+
+    def _has_pending(self):
+        return bool(self._pending or self._clear)
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+            self._check_half_life(self._db)
+        return self._db
+
+    def _check_half_life(self, db):
+        # Weights depend on the half-life, so recompute them if it changed
+        row = db.execute("SELECT value FROM meta WHERE key = 'half_life'").fetchone()
+        if row is not None and math.isclose(float(row[0]), self.half_life):
+            return
+        with db:
+            if row is not None:
+                logging.info("Spanner decay half-life changed, recomputing scores.")
+                weights = {}
+                for user_id, created_at in db.execute("SELECT user_id, created_at FROM spanner_events"):
+                    weights[user_id] = weights.get(user_id, 0.0) + self._weight(created_at)
+                db.execute("UPDATE spanner_scores SET weight = 0")
+                db.executemany("UPDATE spanner_scores SET weight = ? WHERE user_id = ?", [(w, u) for u, w in weights.items()])
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('half_life', ?)", (str(self.half_life),))
+
+    def _query(self, sql, params=()):
+        with self._db_lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def _write(self, batch):
+        rows, clear = batch
+        with self._db_lock:
+            db = self._connect()
+            with db:
+                if clear:
+                    db.execute("DELETE FROM spanner_events")
+                    db.execute("DELETE FROM spanner_scores")
+                self._insert(db, rows)
+
+    def _insert(self, db, rows):
+        if not rows:
+            return
+        db.executemany(
+            "INSERT INTO spanner_events (user_id, guild_id, reason, created_at) VALUES (?, ?, ?, ?)",
+            [(user_id, guild_id, reason, created_at) for user_id, _, guild_id, reason, created_at in rows],
+        )
+        db.executemany(
+            """INSERT INTO spanner_scores (user_id, mention, total, weight) VALUES (?, ?, 1, ?)
+               ON CONFLICT (user_id) DO UPDATE SET
+                   mention = excluded.mention, total = total + 1, weight = weight + excluded.weight""",
+            [(user_id, mention, self._weight(created_at)) for user_id, mention, _, _, created_at in rows],
+        )
@@ -0,0 +1,51 @@
+import logging
+from spanner_store import SpannerStore, REASON_UNKEEN
+from leaderboard import SpannerLeaderboard
+
+
+class SpannerTracker:
+    """Spanner history shared by every lobby: the event store and the all-time leaderboard.
+
+    Events live in SQLite; only per-user totals are held in memory, so
+    startup and memory scale with the number of spannerers rather than the
+    number of spanners. An old spanner_tracker.csv is imported once on load.
+    """
+
+    def __init__(self, path='spanner_tracker.csv', db_path='spanners.db'):
+        self.csv_path = path  # Legacy tracker, only read for the one-time import
+        self.store = SpannerStore(db_path)
+        self.leaderboard = SpannerLeaderboard()  # Per-user spanner counts
+
+    def record(self, user_id, mention, reason=REASON_UNKEEN, guild_id=None):
+        """Record a spanner and write it to the store in the background."""
+        self.leaderboard.add(user_id, mention)
+        self.store.add(user_id, mention, reason, guild_id)
+
+    def clear(self):
+        """Forget every recorded spanner."""
+        self.leaderboard.clear()
+        self.store.clear()
+
+    def save(self):
+        """Write any queued spanner events now."""
+        self.store.flush_sync()
+
+    def load(self, import_csv=True):
+        """Import the legacy CSV if it hasn't been yet, then load per-user totals.
+
+        With several processes sharing the store, only one should import.
+        """
+        try:
+            if import_csv:
+                self.store.import_csv(self.csv_path)
+            self.leaderboard.load_totals(self.store.totals())
+        except Exception as e:
+            logging.error(f"Error loading spanner tracker: {e}")
+
+    async def refresh(self):
+        """Reload per-user totals from the store, picking up spanners recorded by other processes."""
+        totals, unwritten, cleared = await self.store.fetch_unwritten(self.store.totals)
+        # Spanners recorded here while the query ran aren't in it yet, so add them on top
+        self.leaderboard.load_totals([] if cleared else totals)
+        for user_id, mention, *_ in unwritten:
+            self.leaderboard.add(user_id, mention)
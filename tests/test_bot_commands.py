@@ -0,0 +1,134 @@
+import sys
+import os
+import asyncio
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+import bot_commands
+from queue_manager import QueueManager
+from spanners import SpannerTracker
+from conditional_store import ConditionalStore
+from metrics import metrics
+
+def make_interaction(client, user_id):
+    interaction = MagicMock()
+    interaction.client = client
+    interaction.user = SimpleNamespace(id=user_id, mention=f"<@{user_id}>")
+    interaction.channel_id = 10
+    interaction.response.defer = AsyncMock()
+    interaction.response.send_message = AsyncMock()
+    interaction.followup.send = AsyncMock()
+    return interaction
+
+class TestCommandPipeline(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.qm = QueueManager(guild_id=1, channel_id=10)
+        self.qm.outbound.coalesce_window = 0
+        self.channel = MagicMock()
+        self.channel.send = AsyncMock(return_value=MagicMock(id=99, add_reaction=AsyncMock()))
+        self.client = MagicMock()
+        self.client.get_channel.return_value = self.channel
+
+    async def test_burst_of_keens_never_overfills_the_queue(self):
+        interactions = [make_interaction(self.client, user_id) for user_id in range(1, 21)]
+        await asyncio.gather(*(bot_commands.keen_command(interaction, self.qm) for interaction in interactions))
+
+        self.assertEqual(len(self.qm.keen_queue), self.qm.QUEUE_LIMIT)
+        self.assertTrue(self.qm.ready_check_active)
+        for interaction in interactions:
+            interaction.response.defer.assert_awaited_once()
+            interaction.followup.send.assert_awaited_once()
+        full = [i for i in interactions if "queue is full" in i.followup.send.call_args.args[0]]
+        self.assertEqual(len(full), 15)
+
+        # Exactly one ready check message, sent on its own
+        await asyncio.sleep(0.05)
+        ready_checks = [call for call in self.channel.send.call_args_list if "ALL ABOARD" in call.args[0]]
+        self.assertEqual(len(ready_checks), 1)
+        for task in list(self.qm.actor._tasks):
+            task.cancel()
+
+    async def test_repeated_clicks_from_one_user_are_merged(self):
+        first = make_interaction(self.client, 7)
+        second = make_interaction(self.client, 7)
+        await asyncio.gather(
+            bot_commands.potentially_keen_command(first, self.qm),
+            bot_commands.potentially_keen_command(second, self.qm),
+        )
+
+        self.assertIn(7, self.qm.potential_queue)  # Toggled once, not on and back off
+        self.assertEqual(self.qm.actor.coalesced, 1)
+        self.assertEqual(first.followup.send.call_args, second.followup.send.call_args)
+
+    async def test_announcements_from_one_pass_are_posted_together(self):
+        interactions = [make_interaction(self.client, user_id) for user_id in range(1, 3)]
+        await asyncio.gather(*(bot_commands.keen_command(interaction, self.qm) for interaction in interactions))
+        await asyncio.sleep(0.05)
+
+        self.channel.send.assert_awaited_once()
+        posted = self.channel.send.call_args.args[0]
+        self.assertIn("<@1> has joined the queue at position 1/5.", posted)
+        self.assertIn("<@2> has joined the queue at position 2/5.", posted)
+
+    async def test_interaction_replies_are_timed(self):
+        def count(call):
+            histogram = metrics.get_histogram("spanner_rest_seconds", call=call, outcome="ok")
+            return histogram.count if histogram else 0
+
+        before = {call: count(call) for call in ("interaction.defer", "followup.send", "interaction.send_message")}
+        await bot_commands.keen_command(make_interaction(self.client, 1), self.qm)
+        await bot_commands.keeners_command(make_interaction(self.client, 2), self.qm)
+        self.assertEqual({call: count(call) - n for call, n in before.items()}, dict.fromkeys(before, 1))
+
+    async def test_second_conditional_keen_replaces_the_first(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.qm.conditional_store = ConditionalStore(os.path.join(tmpdir.name, 'conditional_queue.json'))
+        await bot_commands.keen_command(make_interaction(self.client, 7), self.qm, minutes=5)
+        self.qm.set_conditional_message(7, 99, time.time() + 60)
+        bot_commands.register_conditional_vote(self.client, self.qm, 7, 99)
+
+        await bot_commands.keen_command(make_interaction(self.client, 7), self.qm, minutes=10)
+        self.assertIsNone(self.qm.reaction_router.get(99))
+        # A late ✅ on the old check-in doesn't answer the new one
+        await self.qm.reaction_router.dispatch(SimpleNamespace(message_id=99, user_id=7, emoji="✅"))
+        await asyncio.sleep(0.01)
+        self.assertNotIn(7, self.qm.keen_queue)
+        self.assertEqual(self.qm.conditional_queue[7]["message_id"], None)
+        self.assertAlmostEqual(self.qm.conditional_queue[7]["deadline"], time.time() + 600, delta=5)
+
+class TestReadyCheck(unittest.IsolatedAsyncioTestCase):
+    async def test_keener_leaving_mid_check_does_not_hold_it_up(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        spanners = SpannerTracker(os.path.join(tmpdir.name, 'spanner_tracker.csv'), os.path.join(tmpdir.name, 'spanners.db'))
+        self.addCleanup(spanners.store.close)
+        qm = QueueManager(guild_id=1, channel_id=10, spanners=spanners)
+        qm.outbound.coalesce_window = 0
+        qm.READY_CHECK_TIMEOUT = 5
+        channel = MagicMock()
+        channel.send = AsyncMock(return_value=MagicMock(id=99, add_reaction=AsyncMock()))
+        client = MagicMock()
+        client.get_channel.return_value = channel
+
+        for user_id in range(1, 6):
+            qm.add_to_queue(user_id)
+        check = asyncio.get_running_loop().create_task(bot_commands.ready_check(client, 10, qm))
+        await asyncio.sleep(0.01)
+        bot_commands.unkeen_change(client, qm, 5)
+        for user_id in range(1, 5):
+            await qm.reaction_router.dispatch(SimpleNamespace(message_id=99, user_id=user_id, emoji="✅"))
+        await asyncio.wait_for(check, 1)
+        await asyncio.sleep(0.01)
+
+        posted = " ".join(call.args[0] for call in channel.send.call_args_list)
+        self.assertIn("Everyone is ready!", posted)
+        self.assertNotIn("not readying up", posted)
+        self.assertEqual(spanners.leaderboard.counts.get(5), 1)
+
+if __name__ == '__main__':
+    unittest.main()
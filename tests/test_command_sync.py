@@ -0,0 +1,49 @@
+import sys
+import os
+import tempfile
+import unittest
+from unittest.mock import AsyncMock
+import discord
+from discord import app_commands
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+from command_sync import command_signature, sync_commands
+
+class TestCommandSync(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.bot = discord.Client(intents=discord.Intents.none())
+        self.bot.tree = app_commands.CommandTree(self.bot)
+        self.bot.tree.sync = AsyncMock()
+
+        @self.bot.tree.command(name="keen", description="Join the queue")
+        async def keen(interaction: discord.Interaction):
+            pass
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'command_sync.json')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    async def test_sync_skipped_until_commands_change(self):
+        self.assertTrue(await sync_commands(self.bot, path=self.path))
+        self.assertFalse(await sync_commands(self.bot, path=self.path))
+        self.assertEqual(self.bot.tree.sync.await_count, 1)
+
+        @self.bot.tree.command(name="unkeen", description="Leave the queue")
+        async def unkeen(interaction: discord.Interaction):
+            pass
+
+        self.assertTrue(await sync_commands(self.bot, path=self.path))
+        self.assertEqual(self.bot.tree.sync.await_count, 2)
+
+    async def test_force_always_syncs(self):
+        await sync_commands(self.bot, path=self.path)
+        self.assertTrue(await sync_commands(self.bot, force=True, path=self.path))
+        self.assertEqual(self.bot.tree.sync.await_count, 2)
+
+    def test_signature_is_stable(self):
+        self.assertEqual(command_signature(self.bot), command_signature(self.bot))
+
+if __name__ == "__main__":
+    unittest.main()
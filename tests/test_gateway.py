@@ -0,0 +1,59 @@
+import sys
+import os
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+from gateway import EntityCache, cache_report, client_options, lean_intents
+
+class TestLeanGateway(unittest.TestCase):
+    def test_lean_intents_only_cover_used_features(self):
+        intents = lean_intents()
+        self.assertTrue(intents.guilds)
+        self.assertTrue(intents.guild_reactions)
+        self.assertTrue(intents.message_content)
+        self.assertFalse(intents.members)
+        self.assertFalse(intents.presences)
+        self.assertFalse(intents.typing)
+        self.assertFalse(intents.voice_states)
+        self.assertFalse(intents.dm_messages)
+
+    def test_lean_options_disable_message_and_member_caches(self):
+        options = client_options(lean=True)
+        self.assertIsNone(options["max_messages"])
+        self.assertEqual(options["member_cache_flags"].value, 0)
+        self.assertFalse(options["chunk_guilds_at_startup"])
+
+        self.assertTrue(client_options(lean=False)["intents"].message_content)
+        self.assertNotIn("max_messages", client_options(lean=False))
+        self.assertEqual(client_options(lean=True, message_cache_size=50)["max_messages"], 50)
+
+    def test_cache_report(self):
+        guild = SimpleNamespace(channels=[1, 2, 3], members=[])
+        bot = SimpleNamespace(guilds=[guild, guild], users=[1], cached_messages=[])
+        report = cache_report(bot)
+        self.assertEqual(report["guilds"], 2)
+        self.assertEqual(report["channels"], 6)
+        self.assertEqual(report["members"], 0)
+        self.assertGreater(report["peak_rss_mb"], 0)
+
+class TestEntityCache(unittest.TestCase):
+    def setUp(self):
+        self.bot = MagicMock()
+        self.bot.get_channel.return_value = None
+        self.bot.get_partial_messageable.side_effect = lambda channel_id: SimpleNamespace(id=channel_id)
+        self.entities = EntityCache(self.bot, maxsize=2)
+
+    def test_channels_fall_back_to_partial_messageables_and_are_evicted(self):
+        self.assertEqual(self.entities.channel(1).id, 1)
+        self.assertIs(self.entities.channel(1), self.entities.channel(1))
+        self.entities.channel(2)
+        self.entities.channel(1)  # 1 is now the most recently used
+        self.entities.channel(3)
+
+        self.assertEqual(list(self.entities._channels), [1, 3])
+        self.assertEqual(self.bot.get_partial_messageable.call_count, 3)
+
+if __name__ == '__main__':
+    unittest.main()
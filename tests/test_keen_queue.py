@@ -0,0 +1,45 @@
+import sys
+import os
+import unittest
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+from keen_queue import KeenQueue, FLAG_REJOINED, FLAG_READIED
+
+class TestKeenQueue(unittest.TestCase):
+    def test_positions_follow_removals_from_the_middle(self):
+        queue = KeenQueue()
+        for user_id in (10, 20, 30, 40):
+            queue.add(user_id)
+        queue.remove(20)
+        self.assertEqual(list(queue), [10, 30, 40])
+        self.assertEqual([queue.position(user_id) for user_id in queue], [1, 2, 3])
+        self.assertIsNone(queue.position(20))
+        self.assertNotIn(20, queue)
+
+    def test_entries_keep_join_time_and_flags(self):
+        queue = KeenQueue()
+        self.assertEqual(queue.add(10, joined_at=123.0, flags=FLAG_REJOINED), 1)
+        entry = queue.get(10)
+        self.assertEqual((entry.joined_at, entry.flags), (123.0, FLAG_REJOINED))
+        self.assertEqual(queue.add(10), 1)  # Already queued
+        self.assertEqual(len(queue), 1)
+
+        queue.add(20)
+        queue.touch(10, 456.0, FLAG_READIED)
+        self.assertEqual((entry.joined_at, entry.flags), (456.0, FLAG_REJOINED | FLAG_READIED))
+        self.assertEqual(list(queue), [10, 20])
+        self.assertIsNone(queue.touch(30, 456.0))
+
+    def test_slots_are_renumbered_when_the_tree_fills(self):
+        queue = KeenQueue(capacity=4)
+        for user_id in range(100):
+            queue.add(user_id)
+            if user_id % 2:
+                queue.remove(user_id - 1)
+        self.assertEqual(list(queue), list(range(1, 100, 2)))
+        self.assertEqual(queue.position(99), len(queue))
+        queue.clear()
+        self.assertEqual(len(queue), 0)
+
+if __name__ == "__main__":
+    unittest.main()
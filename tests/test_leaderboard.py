@@ -0,0 +1,32 @@
+import sys
+import os
+import unittest
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+from leaderboard import SpannerLeaderboard
+
+class TestSpannerLeaderboard(unittest.TestCase):
+    def setUp(self):
+        self.leaderboard = SpannerLeaderboard()
+        self.leaderboard.rebuild([(1, '<@1>'), (2, '<@2>'), (2, '<@2>'), (3, '<@3>')])
+
+    def test_counts_and_ranks(self):
+        self.assertEqual(self.leaderboard.count(2), 2)
+        self.assertEqual(self.leaderboard.rank(2), 1)
+        self.assertEqual(self.leaderboard.rank(1), 2)
+        self.assertEqual(self.leaderboard.rank(3), 2)  # Ties share a rank
+        self.assertIsNone(self.leaderboard.rank(4))
+
+    def test_add_moves_user_up(self):
+        self.leaderboard.add(3, '<@3>')
+        self.leaderboard.add(3, '<@3>')
+        self.assertEqual(self.leaderboard.top(1), [(1, 3, '<@3>', 3)])
+        self.assertEqual(self.leaderboard.rank(2), 2)
+
+    def test_pages(self):
+        self.assertEqual([user_id for _, user_id, _, _ in self.leaderboard.top(2, offset=1)], [1, 3])
+        self.leaderboard.clear()
+        self.assertEqual(self.leaderboard.top(10), [])
+
+if __name__ == "__main__":
+    unittest.main()
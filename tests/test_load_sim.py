@@ -0,0 +1,56 @@
+import sys
+import os
+import logging
+import unittest
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+sys.path.append(os.path.join(parent_dir, 'benchmarks'))
+from load_sim import random_workload, run_simulation, compare_to_baseline, timing_notes
+
+class TestLoadSimulation(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.INFO)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def test_small_workload_runs_ready_checks_without_errors(self):
+        workload = random_workload(users=60, lobbies=3, commands=300, duration=0.2, seed=3)
+        report = run_simulation(workload, ready_check_timeout=0.1, react_delay=0.02)
+
+        self.assertEqual(report["errors"], [])
+        self.assertEqual(report["commands"], 300)
+        self.assertEqual(report["lobbies"], 3)
+        self.assertGreater(report["ready_checks"], 0)
+        self.assertEqual(sum(stats["count"] for stats in report["latency"].values()), 300)
+
+    def test_ready_checks_pass_when_everyone_reacts(self):
+        workload = random_workload(users=60, lobbies=3, commands=300, duration=0.2, seed=3)
+        report = run_simulation(workload, ready_rate=1.0, ready_check_timeout=0.5, react_delay=0.02)
+
+        self.assertGreater(report["ready_checks_passed"], 0)
+        self.assertEqual(report["ready_checks_timed_out"], 0)
+
+    def test_compare_to_baseline_gates_on_machine_independent_results(self):
+        baseline = {
+            "throughput": 1000.0,
+            "latency": {"keen": {"count": 10, "p95": 0.001, "p99": 0.002}},
+            "ack_latency": {"keen": {"count": 10, "p99": 0.0001}},
+            "loop_lag": {"p99": 0.001},
+            "peak_memory_mb": 10.0,
+            "max_queue_length": 5,
+            "ready_checks_passed": 6,
+            "ready_checks_timed_out": 4,
+        }
+        report = dict(baseline, errors=[])
+        self.assertEqual(compare_to_baseline(report, baseline), [])
+
+        # A slower machine only produces notes
+        slow = dict(report, throughput=100.0, latency={"keen": {"count": 10, "p95": 0.5, "p99": 0.6}})
+        self.assertEqual(compare_to_baseline(slow, baseline), [])
+        self.assertEqual(len(timing_notes(slow, baseline)), 2)
+
+        broken = dict(report, max_queue_length=7, ack_latency={"keen": {"count": 10, "p99": 0.002}},
+                      ready_checks_passed=0, ready_checks_timed_out=10)
+        self.assertEqual(len(compare_to_baseline(broken, baseline)), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import sys
+import os
+import asyncio
+import time
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+import bot_commands
+from lobbies import LobbyRegistry
+
+class TestLobbyRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.lobbies = LobbyRegistry(
+            idle_timeout=60,
+            spanner_path=os.path.join(self.tmpdir.name, 'spanner_tracker.csv'),
+            conditional_path=os.path.join(self.tmpdir.name, 'conditional_queue.json'),
+            spanner_db_path=os.path.join(self.tmpdir.name, 'spanners.db'),
+            state_path=os.path.join(self.tmpdir.name, 'lobbies.json'),
+            state_log_path=os.path.join(self.tmpdir.name, 'lobbies.log'),
+        )
+
+    def test_lobbies_are_created_lazily_and_kept_apart(self):
+        first = self.lobbies.get(1, 10)
+        second = self.lobbies.get(1, 11)
+        self.assertIs(self.lobbies.get(1, 10), first)
+        self.assertEqual(len(self.lobbies), 2)
+
+        first.add_to_queue(1)
+        first.ready_check_active = True
+        self.assertEqual(len(second.keen_queue), 0)
+        self.assertFalse(second.ready_check_active)
+        self.assertIsNot(first.actor, second.actor)
+
+    def test_lobbies_use_the_registry_collaborators_even_while_empty(self):
+        lobby = self.lobbies.get(1, 10)
+        self.assertEqual(len(self.lobbies.reaction_router), 0)
+        self.assertIs(lobby.reaction_router, self.lobbies.reaction_router)
+        self.assertIs(lobby.scheduler, self.lobbies.scheduler)
+        self.assertIs(lobby.outbound, self.lobbies.outbound)
+        self.assertIs(lobby.spanners, self.lobbies.spanners)
+        self.assertIs(lobby.conditional_store, self.lobbies.conditional_store)
+
+    def test_scheduler_jobs_are_namespaced_per_lobby(self):
+        first = self.lobbies.get(1, 10)
+        second = self.lobbies.get(2, 20)
+        first.add_to_queue(1)
+        second.add_to_queue(1)
+        first.remove_from_queue(1)
+        self.assertFalse(first.has_job("timeout", 1))
+        self.assertTrue(second.has_job("timeout", 1))
+
+    def test_only_idle_lobbies_are_evicted(self):
+        busy = self.lobbies.get(1, 10)
+        self.lobbies.get(2, 20)
+        busy.add_to_queue(1)
+        self.assertEqual(self.lobbies.evict_idle(now=time.time() + 120), 1)
+        self.assertEqual(list(self.lobbies.lobbies), [(1, 10)])
+
+class TestRegistryReadyCheck(unittest.IsolatedAsyncioTestCase):
+    async def test_ready_check_completes_through_the_registry_router(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        lobbies = LobbyRegistry(
+            spanner_path=os.path.join(tmpdir.name, 'spanner_tracker.csv'),
+            conditional_path=os.path.join(tmpdir.name, 'conditional_queue.json'),
+            spanner_db_path=os.path.join(tmpdir.name, 'spanners.db'),
+            state_path=os.path.join(tmpdir.name, 'lobbies.json'),
+            state_log_path=os.path.join(tmpdir.name, 'lobbies.log'),
+        )
+        self.addCleanup(lobbies.spanners.store.close)
+        lobbies.outbound.coalesce_window = 0
+        channel = MagicMock()
+        channel.send = AsyncMock(return_value=MagicMock(id=99, add_reaction=AsyncMock()))
+        client = MagicMock()
+        client.get_channel.return_value = channel
+        lobby = lobbies.get(1, 10)
+        lobby.READY_CHECK_TIMEOUT = 5
+
+        for user_id in range(1, 6):
+            lobby.add_to_queue(user_id)
+        check = asyncio.get_running_loop().create_task(bot_commands.ready_check(client, 10, lobby))
+        await asyncio.sleep(0.01)
+        # Reactions reach the bot through the registry's router, as in bot.py's on_raw_reaction_add
+        for user_id in range(1, 6):
+            await lobbies.reaction_router.dispatch(SimpleNamespace(message_id=99, user_id=user_id, emoji="✅"))
+        await asyncio.wait_for(check, 1)
+        await asyncio.sleep(0.01)
+
+        posted = " ".join(call.args[0] for call in channel.send.call_args_list)
+        self.assertIn("Everyone is ready!", posted)
+        self.assertEqual(len(lobby.keen_queue), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,217 @@
+import sys
+import os
+import asyncio
+import time
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+import bot_commands
+from lobbies import LobbyRegistry
+from keen_queue import FLAG_CONDITIONAL, FLAG_READIED
+
+class StateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def registry(self):
+        return LobbyRegistry(
+            spanner_path=os.path.join(self.tmpdir.name, 'spanner_tracker.csv'),
+            conditional_path=os.path.join(self.tmpdir.name, 'conditional_queue.json'),
+            spanner_db_path=os.path.join(self.tmpdir.name, 'spanners.db'),
+            state_path=os.path.join(self.tmpdir.name, 'lobbies.json'),
+            state_log_path=os.path.join(self.tmpdir.name, 'lobbies.log'),
+        )
+
+class TestLobbyRecovery(StateTestCase):
+    def test_checkpoint_plus_change_log_restores_queues(self):
+        before = self.registry()
+        lobby = before.get(1, 10)
+        for user_id in (3, 1, 2):
+            lobby.add_to_queue(user_id)
+        lobby.add_potential(7)
+        before.state.checkpoint_sync(before)
+
+        # Changes after the checkpoint only exist in the change log
+        lobby.remove_from_queue(1)
+        lobby.add_to_queue(4, FLAG_CONDITIONAL)
+        lobby.start_unkeen_cooldown(1)
+        lobby.remove_potential(7)
+        before.get(2, 20).add_to_queue(9)
+        with open(before.state.log_path, 'a', encoding='utf-8') as f:
+            f.write('[99,1,10,"jo')  # Torn by a crash mid-write
+
+        after = self.registry()
+        after.load(bot=None)
+        restored = after.get(1, 10)
+        self.assertEqual([user_id for user_id, _ in restored.keen_queue.items()], [3, 2, 4])
+        for user_id, entry in lobby.keen_queue.items():
+            self.assertEqual(restored.keen_queue.get(user_id).joined_at, entry.joined_at)
+        self.assertEqual(restored.keen_queue.get(4).flags, FLAG_CONDITIONAL)
+        self.assertEqual(restored.potential_queue, set())
+        self.assertEqual(restored.unkeen_cooldown, lobby.unkeen_cooldown)
+        self.assertTrue(restored.has_job("timeout", 3))
+        self.assertTrue(restored.has_job("cooldown", 1))
+        self.assertEqual(list(after.get(2, 20).keen_queue), [9])
+
+        # Loading folds the log into a fresh checkpoint
+        self.assertEqual(os.path.getsize(after.state.log_path), 0)
+        again = self.registry()
+        again.load(bot=None)
+        self.assertEqual(list(again.get(1, 10).keen_queue), [3, 2, 4])
+
+    def test_readied_users_keep_their_fresh_timeout(self):
+        before = self.registry()
+        lobby = before.get(1, 10)
+        lobby.add_to_queue(5)
+        lobby.add_to_queue(6)
+        lobby.keen_queue.get(5).joined_at -= 3000  # Joined 50 minutes before the ready check
+        lobby.add_to_queue(5, FLAG_READIED)
+        deadline = lobby.scheduler.deadline((lobby.key, "timeout", 5))
+
+        after = self.registry()
+        after.load(bot=None)
+        restored = after.get(1, 10)
+        self.assertEqual(list(restored.keen_queue), [5, 6])
+        self.assertEqual(restored.keen_queue.get(5).flags, FLAG_READIED)
+        self.assertEqual(restored.scheduler.deadline((restored.key, "timeout", 5)), deadline)
+
+    def test_timed_out_users_keep_their_rejoin_window(self):
+        before = self.registry()
+        lobby = before.get(1, 10)
+        lobby.add_to_queue(5)
+        lobby.keen_queue.remove(5)
+        lobby.log_change("timeout", 5, time.time() + 300)
+
+        after = self.registry()
+        after.load(bot=None)
+        self.assertNotIn(5, after.get(1, 10).keen_queue)
+        self.assertTrue(after.get(1, 10).has_job("rejoin", 5))
+
+    def test_rejoin_window_that_found_the_queue_full_is_not_revived(self):
+        before = self.registry()
+        lobby = before.get(1, 10)
+        lobby.add_to_queue(5)
+        lobby.keen_queue.remove(5)
+        lobby.log_change("timeout", 5, time.time() + 300)
+        for user_id in range(1, lobby.QUEUE_LIMIT + 1):
+            lobby.add_to_queue(user_id + 10)
+
+        async def rejoin_window_fires():
+            await lobby._on_rejoin_window(5)
+            await before.state.flush()
+
+        asyncio.run(rejoin_window_fires())
+
+        after = self.registry()
+        after.load(bot=None)
+        self.assertFalse(after.get(1, 10).has_job("rejoin", 5))
+
+    def test_restoring_many_lobbies_is_fast(self):
+        before = self.registry()
+        for channel_id in range(500):
+            lobby = before.get(1, channel_id)
+            for user_id in range(4):
+                lobby.add_to_queue(user_id)
+        before.state.checkpoint_sync(before)
+
+        after = self.registry()
+        start = time.perf_counter()
+        after.load(bot=None)
+        self.assertEqual(len(after), 500)
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+class TestCheckpointBeforeLoad(StateTestCase, unittest.IsolatedAsyncioTestCase):
+    async def saved_registry(self):
+        before = self.registry()
+        before.get(1, 10).add_to_queue(3)
+        before.state.checkpoint_sync(before)
+        before.get(1, 10).add_to_queue(4)  # Only in the change log
+        await before.state.flush()
+        after = self.registry()
+        after.checkpoint_interval = 0.01
+        return after
+
+    async def test_periodic_checkpoint_waits_for_load(self):
+        after = await self.saved_registry()
+        runner = asyncio.get_running_loop().create_task(after.run(bot=None))
+        await asyncio.sleep(0.05)  # Several checkpoint intervals before the gateway is ready
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+
+        after.load(bot=None)
+        self.assertEqual(list(after.get(1, 10).keen_queue), [3, 4])
+
+    async def test_shutdown_before_load_keeps_saved_state(self):
+        after = await self.saved_registry()
+        after.save()
+
+        again = self.registry()
+        again.load(bot=None)
+        self.assertEqual(list(again.get(1, 10).keen_queue), [3, 4])
+
+    async def test_shutdown_writes_conditional_keens_still_waiting_to_save(self):
+        before = self.registry()
+        before.load(bot=None)
+        before.get(1, 10).add_conditional(5, time.time() + 600)  # Written behind, after this test's loop is gone
+        before.save()
+
+        again = self.registry()
+        again.load(bot=None)
+        self.assertIn(5, again.get(1, 10).conditional_queue)
+
+class TestReadyCheckRecovery(StateTestCase, unittest.IsolatedAsyncioTestCase):
+    async def restored_lobby(self, voters):
+        before = self.registry()
+        lobby = before.get(1, 10)
+        for user_id in range(1, 6):
+            lobby.add_to_queue(user_id)
+        lobby.ready_check_active = True
+        lobby.start_ready_check(55, list(lobby.keen_queue), time.time() + 600)
+        await before.state.flush()
+
+        after = self.registry()
+        after.load(bot=None)
+        lobby = after.get(1, 10)
+        self.assertTrue(lobby.ready_check_active)
+
+        users = [SimpleNamespace(id=user_id) for user_id in voters]
+
+        async def reactors():
+            for user in users:
+                yield user
+
+        message = MagicMock(reactions=[SimpleNamespace(emoji="✅", users=reactors)])
+        self.channel = MagicMock()
+        self.channel.fetch_message = AsyncMock(return_value=message)
+        self.channel.send = AsyncMock(return_value=MagicMock(id=56, add_reaction=AsyncMock()))
+        self.client = MagicMock()
+        self.client.get_channel.return_value = self.channel
+        lobby.outbound.coalesce_window = 0
+        return lobby
+
+    async def test_ready_check_that_finished_while_down_is_resolved(self):
+        lobby = await self.restored_lobby(voters=range(1, 6))
+        await bot_commands.resume_lobby(self.client, lobby)
+
+        self.assertEqual(len(lobby.keen_queue), 0)
+        self.assertFalse(lobby.ready_check_active)
+        self.assertIsNone(lobby.ready_check)
+
+    async def test_unfinished_ready_check_is_restarted(self):
+        lobby = await self.restored_lobby(voters=[1, 2])
+        lobby.READY_CHECK_TIMEOUT = 0.05
+        await bot_commands.resume_lobby(self.client, lobby)
+
+        self.assertTrue(lobby.ready_check_active)
+        for task in list(lobby.actor._tasks):
+            await task
+        posted = [call.args[0] for call in self.channel.send.call_args_list]
+        self.assertTrue(any("fresh one" in content for content in posted))
+        self.assertTrue(any("ALL ABOARD" in content for content in posted))
+
+if __name__ == '__main__':
+    unittest.main()
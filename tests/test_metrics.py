@@ -0,0 +1,72 @@
+import sys
+import os
+import asyncio
+import tempfile
+import unittest
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+from metrics import Metrics
+from lobbies import LobbyRegistry
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_histogram_render_is_cumulative(self):
+        self.metrics.observe("cmd_seconds", 0.002, command="keen")
+        self.metrics.observe("cmd_seconds", 0.2, command="keen")
+        self.metrics.observe("cmd_seconds", 1000, command="keen")
+        text = self.metrics.render()
+
+        self.assertIn("# TYPE cmd_seconds histogram", text)
+        self.assertIn('cmd_seconds_bucket{command="keen",le="0.001"} 0', text)
+        self.assertIn('cmd_seconds_bucket{command="keen",le="0.005"} 1', text)
+        self.assertIn('cmd_seconds_bucket{command="keen",le="0.25"} 2', text)
+        self.assertIn('cmd_seconds_bucket{command="keen",le="+Inf"} 3', text)
+        self.assertIn('cmd_seconds_count{command="keen"} 3', text)
+        self.assertEqual(self.metrics.get_histogram("cmd_seconds", command="keen").quantile(0.5), 0.25)
+
+    def test_timer_labels_the_outcome(self):
+        with self.metrics.timer("flush_seconds", store="csv"):
+            pass
+        with self.assertRaises(ValueError):
+            with self.metrics.timer("flush_seconds", store="csv"):
+                raise ValueError("disk full")
+
+        self.assertEqual(self.metrics.get_histogram("flush_seconds", store="csv", outcome="ok").count, 1)
+        self.assertEqual(self.metrics.get_histogram("flush_seconds", store="csv", outcome="error").count, 1)
+
+    def test_lobby_gauges(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        lobbies = LobbyRegistry(state_path=os.path.join(tmpdir.name, 'lobbies.json'), state_log_path=os.path.join(tmpdir.name, 'lobbies.log'))
+        lobbies.register_metrics(self.metrics)
+        lobby = lobbies.get(1, 10)
+        lobby.add_to_queue(5)
+        lobby.potential_queue.add(6)
+        self.metrics.inc("ready_checks_total", outcome="ready")
+        text = self.metrics.render()
+
+        self.assertIn("spanner_lobbies 1", text)
+        self.assertIn('spanner_queue_size{queue="keen"} 1', text)
+        self.assertIn('spanner_queue_size{queue="potential"} 1', text)
+        self.assertIn('ready_checks_total{outcome="ready"} 1', text)
+
+class TestMetricsEndpoint(unittest.IsolatedAsyncioTestCase):
+    async def test_serves_prometheus_text(self):
+        metrics = Metrics()
+        metrics.inc("requests_total")
+        server = await asyncio.start_server(metrics._handle_http, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            await writer.drain()
+            response = (await reader.read()).decode("utf-8")
+            writer.close()
+
+        self.assertTrue(response.startswith("HTTP/1.1 200 OK"))
+        self.assertIn("requests_total 1", response)
+
+if __name__ == '__main__':
+    unittest.main()
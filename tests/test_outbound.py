@@ -0,0 +1,61 @@
+import sys
+import os
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+from outbound import OutboundPipeline
+
+class TestOutboundPipeline(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.channel = MagicMock()
+        self.channel.id = 1
+        self.channel.send = AsyncMock(side_effect=lambda content: f"message:{content}")
+        self.bot = MagicMock()
+        self.bot.get_channel.return_value = self.channel
+        self.pipeline = OutboundPipeline(coalesce_window=0.01)
+
+    async def test_messages_queued_together_are_coalesced(self):
+        futures = [self.pipeline.send(self.bot, 1, f"line {i}") for i in range(3)]
+        self.assertEqual(self.pipeline.queue_depth(1), 3)
+        results = await asyncio.gather(*futures)
+        self.channel.send.assert_awaited_once_with("line 0\nline 1\nline 2")
+        self.assertEqual(set(results), {"message:line 0\nline 1\nline 2"})
+        self.assertEqual(self.pipeline.stats()["coalesced"], 2)
+
+    async def test_uncoalesced_message_gets_its_own_post(self):
+        first = self.pipeline.send(self.bot, 1, "tag everyone")
+        own = self.pipeline.send(self.bot, 1, "react here", coalesce=False)
+        self.assertEqual(await own, "message:react here")
+        self.assertEqual(await first, "message:tag everyone")
+        self.assertEqual(self.channel.send.await_count, 2)
+
+    async def test_posts_stay_under_the_character_limit(self):
+        futures = [self.pipeline.send(self.bot, 1, "x" * 900) for _ in range(3)]
+        await asyncio.gather(*futures)
+        self.assertEqual(self.channel.send.await_count, 2)
+
+    async def test_missing_channel_resolves_to_none(self):
+        self.bot.get_channel.return_value = None
+        self.assertIsNone(await self.pipeline.send(self.bot, 2, "hello"))
+
+    async def test_idle_outboxes_are_evicted_once_their_bucket_refills(self):
+        pipeline = OutboundPipeline(coalesce_window=0, channel_rate=100.0, channel_burst=1)
+        await pipeline.send(self.bot, 1, "hello")
+        self.assertEqual(pipeline.evict_idle(), 0)  # Still paying off the send
+        await asyncio.sleep(0.02)
+        self.assertEqual(pipeline.evict_idle(), 1)
+        self.assertEqual(pipeline.stats()["channels"], 0)
+
+        await pipeline.send(self.bot, 1, "again")
+        self.assertEqual(self.bot.get_channel.call_count, 2)  # Looked up afresh
+
+    async def test_channel_lookups_go_through_resolve_channel(self):
+        resolved = MagicMock(id=5)
+        self.pipeline.resolve_channel = lambda channel_id: resolved
+        self.assertIs(self.pipeline.channel(self.bot, 5), resolved)
+        self.bot.get_channel.assert_not_called()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,19 @@
 import sys
 import os
+import tempfile
 import unittest
-from unittest.mock import AsyncMock, MagicMock
+from unittest.mock import MagicMock, patch
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(parent_dir)
 from queue_manager import QueueManager
+from conditional_store import ConditionalStore
 
-class TestQueueManager(unittest.TestCase):
+class TestQueueManager(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
+        # A standalone QueueManager reads its channel from the environment; 0 means "find one"
+        env = patch.dict(os.environ, {"PRIVATE_CHANNEL_ID": "0"})
+        env.start()
+        self.addCleanup(env.stop)
         self.bot = MagicMock()
         self.queue_manager = QueueManager()
 
@@ -22,5 +28,40 @@ class TestQueueManager(unittest.TestCase):
         await self.queue_manager.set_channel_id(self.bot)
         self.assertEqual(self.queue_manager.YOUR_CHANNEL_ID, 12345)
 
+    async def test_rejoin_waits_for_the_ready_check(self):
+        self.queue_manager.ready_check_active = True
+        await self.queue_manager._on_rejoin_window(5)
+        self.assertNotIn(5, self.queue_manager.keen_queue)
+        self.assertTrue(self.queue_manager.has_job("rejoin", 5))
+
+    async def test_rejoin_leaves_the_potential_queue_and_checks_progress(self):
+        self.queue_manager.bot = self.bot
+        self.queue_manager.actor.on_batch = MagicMock()
+        self.queue_manager.add_potential(5)
+        await self.queue_manager._on_rejoin_window(5)
+        self.assertIn(5, self.queue_manager.keen_queue)
+        self.assertNotIn(5, self.queue_manager.potential_queue)
+        self.queue_manager.actor.on_batch.assert_called_once_with(self.bot)
+
+    def test_queue_timeouts_are_scheduled(self):
+        self.queue_manager.add_to_queue(1)
+        self.assertTrue(self.queue_manager.has_job("timeout", 1))
+        self.queue_manager.remove_from_queue(1)
+        self.assertNotIn(1, self.queue_manager.keen_queue)
+        self.assertFalse(self.queue_manager.has_job("timeout", 1))
+
+    def test_conditional_queue_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'conditional_queue.json')
+            queue_manager = QueueManager(guild_id=1, channel_id=2, conditional_store=ConditionalStore(path))
+            queue_manager.add_conditional(1, 1000.0)
+            queue_manager.add_conditional(2, 2000.0)
+            queue_manager.set_conditional_message(2, 99, 2300.0)
+            queue_manager.remove_conditional(1)
+
+            restored = QueueManager(guild_id=1, channel_id=2, conditional_store=ConditionalStore(path))
+            restored.load_conditional_queue()
+            self.assertEqual(restored.conditional_queue, {2: {"deadline": 2300.0, "message_id": 99}})
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
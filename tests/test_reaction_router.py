@@ -0,0 +1,40 @@
+import sys
+import os
+import unittest
+from types import SimpleNamespace
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+from reaction_router import PendingVote, ReactionRouter
+
+def reaction(message_id, user_id, emoji="✅"):
+    return SimpleNamespace(message_id=message_id, user_id=user_id, emoji=emoji)
+
+class TestReactionRouter(unittest.IsolatedAsyncioTestCase):
+    async def test_ready_vote_completes_when_everyone_reacts(self):
+        router = ReactionRouter()
+        vote = router.register(10, PendingVote([1, 2], ["✅"]))
+        await router.dispatch(reaction(10, 1))
+        await router.dispatch(reaction(10, 3))  # Not in the vote
+        await router.dispatch(reaction(11, 2))  # Different message
+        await router.dispatch(reaction(10, 2, "❌"))  # Wrong emoji
+        self.assertFalse(await vote.wait(0.01))
+        await router.dispatch(reaction(10, 2))
+        self.assertTrue(await vote.wait(0.01))
+        self.assertEqual(vote.votes, {1: "✅", 2: "✅"})
+
+    async def test_on_vote_called_once_per_user(self):
+        answers = []
+
+        async def on_vote(user_id, emoji):
+            answers.append((user_id, emoji))
+
+        router = ReactionRouter()
+        router.register(10, PendingVote([1], ["✅", "❌"], on_vote=on_vote))
+        await router.dispatch(reaction(10, 1, "❌"))
+        await router.dispatch(reaction(10, 1, "✅"))
+        self.assertEqual(answers, [(1, "❌")])
+        router.unregister(10)
+        self.assertEqual(len(router), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import sys
+import os
+import asyncio
+import time
+import unittest
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+from scheduler import DeadlineScheduler
+
+class TestDeadlineScheduler(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.scheduler = DeadlineScheduler()
+        self.fired = []
+        self.runner = asyncio.create_task(self.scheduler.run())
+
+    async def asyncTearDown(self):
+        self.runner.cancel()
+
+    async def record(self, name):
+        self.fired.append(name)
+
+    async def test_fires_in_deadline_order(self):
+        now = time.time()
+        self.scheduler.schedule("late", now + 0.05, self.record, "late")
+        self.scheduler.schedule("early", now + 0.01, self.record, "early")
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.fired, ["early", "late"])
+        self.assertEqual(len(self.scheduler), 0)
+
+    async def test_cancel_and_reschedule(self):
+        now = time.time()
+        self.scheduler.schedule("a", now + 0.01, self.record, "a")
+        self.scheduler.schedule("b", now + 0.01, self.record, "b")
+        self.assertTrue(self.scheduler.cancel("a"))
+        self.assertFalse(self.scheduler.cancel("a"))
+        self.scheduler.schedule("b", now + 0.03, self.record, "b2")
+        await asyncio.sleep(0.06)
+        self.assertEqual(self.fired, ["b2"])
+
+    async def test_slow_job_does_not_block_others(self):
+        async def slow():
+            await asyncio.sleep(10)
+
+        now = time.time()
+        self.scheduler.schedule("slow", now, slow)
+        self.scheduler.schedule("fast", now + 0.01, self.record, "fast")
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.fired, ["fast"])
+
+class TestSchedulerCancel(unittest.IsolatedAsyncioTestCase):
+    async def test_cancel_just_after_a_wakeup_stops_run(self):
+        scheduler = DeadlineScheduler()
+        scheduler.schedule("later", time.time() + 60, asyncio.sleep, 0)
+        runner = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.01)
+
+        # The new earliest deadline wakes run() up; cancel before it gets to handle that
+        scheduler.schedule("sooner", time.time() + 30, asyncio.sleep, 0)
+        await asyncio.sleep(0)
+        runner.cancel()
+        await asyncio.wait({runner}, timeout=1)
+        self.assertTrue(runner.cancelled())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+import sys
+import os
+import asyncio
+import tempfile
+import time
+import unittest
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+from sharding import Inbox, LocalCoordinator, ShardPlan, shard_for_guild, shard_groups
+from lobbies import LobbyRegistry
+
+class TestShardMath(unittest.TestCase):
+    def test_shard_for_guild_uses_snowflake_timestamp(self):
+        self.assertEqual(shard_for_guild(41771983423143937, 1), 0)
+        self.assertEqual(shard_for_guild(5 << 22, 4), 1)
+        self.assertEqual(shard_for_guild(None, 4), 0)
+
+    def test_groups_cover_every_shard_once(self):
+        self.assertEqual(shard_groups(10, 3), [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]])
+        self.assertEqual(sorted(sum(shard_groups(16, 5), [])), list(range(16)))
+
+class TestShardPlan(unittest.TestCase):
+    def test_each_guild_belongs_to_exactly_one_group(self):
+        plans = [ShardPlan(8, 3, group) for group in range(3)]
+        for guild_id in ((n << 22) for n in range(50)):
+            self.assertEqual(sum(plan.owns_guild(guild_id) for plan in plans), 1)
+
+    def test_from_env_and_paths(self):
+        plan = ShardPlan.from_env({"SHARD_COUNT": "8", "SHARD_GROUPS": "2", "SHARD_GROUP": "1"})
+        self.assertTrue(plan.sharded)
+        self.assertFalse(plan.is_primary)
+        self.assertEqual(plan.bot_options(), {"shard_count": 8, "shard_ids": [4, 5, 6, 7]})
+        self.assertEqual(plan.path('lobbies.json'), 'lobbies.group-1.json')
+
+        single = ShardPlan.from_env({})
+        self.assertFalse(single.sharded)
+        self.assertTrue(single.owns_guild(123 << 22))
+        self.assertEqual(single.path('lobbies.json'), 'lobbies.json')
+
+    def test_stale_groups(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, 'lobbies.json')
+        for name in ('lobbies.json', 'lobbies.group-0.json', 'lobbies.group-1.json', 'lobbies.group-3.json', 'lobbies.group-x.json'):
+            open(os.path.join(tmpdir.name, name), 'w').close()
+        self.assertEqual(ShardPlan(4, 2, 0).stale_groups(path), [None, 3])
+        self.assertEqual(ShardPlan().stale_groups(path), [0, 1, 3])
+
+class TestInbox(unittest.TestCase):
+    def test_discard_keeps_entries_posted_after_the_read(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        inbox = Inbox(os.path.join(tmpdir.name, 'lobbies.inbox'))
+        self.assertEqual(inbox.read(), ([], 0))
+        inbox.post([{"n": 1}, {"n": 2}])
+        entries, size = inbox.read()
+        inbox.post([{"n": 3}])
+        inbox.discard(size)
+        self.assertEqual(entries, [{"n": 1}, {"n": 2}])
+        self.assertEqual(inbox.read()[0], [{"n": 3}])
+
+    def test_torn_line_only_loses_itself(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        inbox = Inbox(os.path.join(tmpdir.name, 'lobbies.inbox'))
+        with open(inbox.path, 'w', encoding='utf-8') as f:
+            f.write('{"n": 1}\n{"n"')
+        self.assertEqual(inbox.read()[0], [{"n": 1}])
+        inbox.post([{"n": 2}])
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(inbox.read()[0], [{"n": 1}, {"n": 2}])
+
+class TestReshard(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.dir = tmpdir.name
+        self.paths = dict(
+            spanner_path=os.path.join(tmpdir.name, 'spanner_tracker.csv'),
+            conditional_path=os.path.join(tmpdir.name, 'conditional_queue.json'),
+            spanner_db_path=os.path.join(tmpdir.name, 'spanners.db'),
+            state_path=os.path.join(tmpdir.name, 'lobbies.json'),
+            state_log_path=os.path.join(tmpdir.name, 'lobbies.log'),
+            inbox_path=os.path.join(tmpdir.name, 'lobbies.inbox'),
+        )
+
+    def registry(self, plan):
+        registry = LobbyRegistry(shards=plan, **self.paths)
+        with self.assertLogs(level='INFO'):
+            registry.load(bot=None)
+        return registry
+
+    def restored(self, registry):
+        return {guild_id >> 22: list(lobby.keen_queue) for (guild_id, _), lobby in registry.lobbies.items()}
+
+    def save_single_process(self):
+        before = self.registry(ShardPlan())
+        for n in range(4):
+            before.get(n << 22, 100 + n).add_to_queue(n + 1)
+        before.get(1 << 22, 101).add_conditional(50, time.time() + 600)
+        before.save()
+        before.conditional_store.save_sync()
+
+    def test_lobbies_reach_their_new_group(self):
+        self.save_single_process()
+        first = self.registry(ShardPlan(2, 2, 0))
+        self.assertEqual(self.restored(first), {0: [1], 2: [3]})
+        # The primary group took over the single-process files and handed on what it doesn't own
+        self.assertFalse(os.path.exists(self.paths['state_path']))
+        self.assertFalse(os.path.exists(self.paths['conditional_path']))
+
+        second = self.registry(ShardPlan(2, 2, 1))
+        self.assertEqual(self.restored(second), {1: [2], 3: [4]})
+        self.assertIn(50, second.get(1 << 22, 101).conditional_queue)
+        self.assertEqual(Inbox(os.path.join(self.dir, 'lobbies.group-1.inbox')).read(), ([], 0))
+
+        # And back to one process, which picks up both groups' files
+        first.save()
+        second.save()
+        single = self.registry(ShardPlan())
+        self.assertEqual(self.restored(single), {0: [1], 1: [2], 2: [3], 3: [4]})
+        self.assertIn(50, single.get(1 << 22, 101).conditional_queue)
+        self.assertFalse(any('.group-' in name for name in os.listdir(self.dir)))
+
+    async def test_group_that_loaded_first_picks_up_handovers_later(self):
+        self.save_single_process()
+        second = self.registry(ShardPlan(2, 2, 1))
+        self.assertEqual(self.restored(second), {})
+        handed_over = []
+        second.on_handover = handed_over.append
+
+        self.registry(ShardPlan(2, 2, 0))
+        with self.assertLogs(level='INFO'):
+            await second._check_inbox()
+        self.assertEqual(self.restored(second), {1: [2], 3: [4]})
+        self.assertEqual(sorted(lobby.guild_id >> 22 for lobby in handed_over), [1, 3])
+        # Saved in its own files, so a restart doesn't need the inbox
+        await second.state.flush()
+        restarted = self.registry(ShardPlan(2, 2, 1))
+        self.assertEqual(self.restored(restarted), {1: [2], 3: [4]})
+        self.assertIn(50, restarted.get(1 << 22, 101).conditional_queue)
+
+class TestLocalCoordinator(unittest.IsolatedAsyncioTestCase):
+    async def test_identifies_are_spaced_out(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = os.path.join(tmpdir.name, 'identify.lock')
+        # Separate instances stand in for separate processes sharing the lock file
+        coordinators = [LocalCoordinator(path, interval=0.1) for _ in range(3)]
+
+        times = []
+
+        async def identify(coordinator, shard_id):
+            await coordinator.identify(shard_id)
+            times.append(time.monotonic())
+
+        await asyncio.gather(*(identify(coordinator, shard_id) for shard_id, coordinator in enumerate(coordinators)))
+        times.sort()
+        for earlier, later in zip(times, times[1:]):
+            self.assertGreaterEqual(later - earlier, 0.09)
+
+if __name__ == '__main__':
+    unittest.main()
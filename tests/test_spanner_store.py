@@ -0,0 +1,168 @@
+import sys
+import os
+import asyncio
+import tempfile
+import threading
+import unittest
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(parent_dir)
+from spanner_store import SpannerStore, REASON_UNKEEN, REASON_READY_CHECK, REASON_IMPORTED
+from spanners import SpannerTracker
+
+DAY = 86400
+NOW = 1_800_000_000
+
+class TestSpannerStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'spanners.db')
+        self.store = SpannerStore(self.path, half_life_days=7)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_windowed_counts_and_history(self):
+        self.store.add(1, '<@1>', REASON_UNKEEN, guild_id=5, created_at=NOW - 40 * DAY)
+        self.store.add(1, '<@1>', REASON_READY_CHECK, guild_id=5, created_at=NOW - 2 * DAY)
+        self.store.add(2, '<@2>', REASON_UNKEEN, guild_id=6, created_at=NOW - 10 * DAY)
+        self.store.add(2, '<@2>', REASON_UNKEEN, guild_id=6, created_at=NOW - 1 * DAY)
+
+        self.assertEqual(self.store.counts_since(NOW - 7 * DAY), [(1, '<@1>', 1), (2, '<@2>', 1)])
+        self.assertEqual(self.store.counts_since(NOW - 30 * DAY), [(2, '<@2>', 2), (1, '<@1>', 1)])
+        self.assertEqual(self.store.counts_since(NOW - 30 * DAY, guild_id=5), [(1, '<@1>', 1)])
+        self.assertEqual(self.store.counts_since(NOW - 30 * DAY, limit=1, offset=1), [(1, '<@1>', 1)])
+        self.assertEqual(self.store.history(1), [(NOW - 2 * DAY, REASON_READY_CHECK, 5), (NOW - 40 * DAY, REASON_UNKEEN, 5)])
+        self.assertEqual(self.store.count_since(2, NOW - 7 * DAY), 1)
+        self.assertEqual(sorted(self.store.totals()), [(1, '<@1>', 2), (2, '<@2>', 2)])
+
+    def test_decayed_scores_halve_every_half_life(self):
+        self.store.add(1, '<@1>', REASON_UNKEEN, created_at=NOW)
+        self.store.add(2, '<@2>', REASON_UNKEEN, created_at=NOW - 7 * DAY)
+        self.store.add(2, '<@2>', REASON_UNKEEN, created_at=NOW - 14 * DAY)
+
+        scores = self.store.decayed_scores(now=NOW)
+        self.assertEqual([user_id for user_id, _, _ in scores], [1, 2])
+        self.assertAlmostEqual(scores[0][2], 1.0)
+        self.assertAlmostEqual(scores[1][2], 0.75)
+        self.assertAlmostEqual(self.store.decayed_score(1, now=NOW + 7 * DAY), 0.5)
+
+        # Reopening with another half-life recomputes the weights
+        self.store.close()
+        store = SpannerStore(self.path, half_life_days=14)
+        self.assertAlmostEqual(store.decayed_score(2, now=NOW), 0.5 ** 0.5 + 0.5)
+        store.close()
+
+    def test_clear(self):
+        self.store.add(1, '<@1>', REASON_UNKEEN, created_at=NOW)
+        self.store.clear()
+        self.assertEqual(self.store.totals(), [])
+        self.assertEqual(self.store.history(1), [])
+
+    def test_batches_writes_off_the_event_loop(self):
+        store = SpannerStore(self.path, flush_delay=0.01)
+
+        async def run():
+            for i in range(100):
+                store.add(i % 10, f'<@{i % 10}>', REASON_UNKEEN)
+            self.assertEqual(store.totals(), [])
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+        self.assertEqual(sum(total for _, _, total in store.totals()), 100)
+        store.close()
+
+    def test_failed_flush_is_retried(self):
+        store = SpannerStore(self.path, flush_delay=60)
+        write = store._write
+        calls = []
+
+        def fail_once(batch):
+            calls.append(batch)
+            if len(calls) == 1:
+                raise OSError("disk full")
+            write(batch)
+
+        store._write = fail_once
+
+        async def run():
+            store.add(1, '<@1>', REASON_UNKEEN)
+            with self.assertRaises(OSError):
+                await store.flush()
+            store.add(2, '<@2>', REASON_UNKEEN)
+            await store.flush()
+            store._flush_task.cancel()
+
+        asyncio.run(run())
+        self.assertEqual(sorted(user_id for user_id, _, _ in store.totals()), [1, 2])
+        store.close()
+
+class TestCsvImport(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmpdir.name, 'spanner_tracker.csv')
+        self.db_path = os.path.join(self.tmpdir.name, 'spanners.db')
+        with open(self.csv_path, 'w', encoding='utf-8') as f:
+            f.write("User ID,Mention\n")
+            for i in range(2500):
+                f.write(f"{i % 7},<@{i % 7}>\n")
+            f.write("not-a-user,oops\n")
+            f.write("3,<@3")  # Torn last line
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_import_once_and_load_totals(self):
+        tracker = SpannerTracker(self.csv_path, self.db_path)
+        tracker.load()
+        self.assertEqual(sum(tracker.leaderboard.counts.values()), 2500)
+        self.assertEqual(tracker.store.history(0, limit=1), [(0.0, REASON_IMPORTED, None)])
+        self.assertEqual(tracker.store.counts_since(0.5), [])
+        self.assertEqual(tracker.store.import_csv(self.csv_path), 0)
+
+        tracker.record(0, '<@0>', REASON_UNKEEN, guild_id=9)
+        tracker.store.close()
+        reloaded = SpannerTracker(self.csv_path, self.db_path)
+        reloaded.load()
+        self.assertEqual(reloaded.leaderboard.count(0), tracker.leaderboard.count(0))
+        reloaded.store.close()
+
+class TestSpannerRefresh(unittest.IsolatedAsyncioTestCase):
+    async def test_spanners_recorded_during_a_refresh_are_kept(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        tracker = SpannerTracker(os.path.join(tmpdir.name, 'spanner_tracker.csv'), os.path.join(tmpdir.name, 'spanners.db'))
+        self.addCleanup(tracker.store.close)
+        tracker.store.flush_delay = 60
+        tracker.record(1, '<@1>')
+        await tracker.store.flush()
+
+        # Another process records a spanner straight into the shared database
+        other = SpannerStore(tracker.store.path)
+        other.add(2, '<@2>', REASON_UNKEEN)
+        other.flush_sync()
+        other.close()
+
+        query_started, recorded = threading.Event(), threading.Event()
+        totals = tracker.store.totals
+
+        def slow_totals():
+            query_started.set()
+            recorded.wait(5)
+            return totals()
+
+        tracker.store.totals = slow_totals
+        refresh = asyncio.get_running_loop().create_task(tracker.refresh())
+        await asyncio.to_thread(query_started.wait, 5)
+        tracker.record(1, '<@1>')
+        recorded.set()
+        await refresh
+
+        self.assertEqual(tracker.leaderboard.count(1), 2)
+        self.assertEqual(tracker.leaderboard.count(2), 1)
+        tracker.store.totals = totals
+        await tracker.refresh()
+        self.assertEqual(tracker.leaderboard.count(1), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,19 @@
+import json
 import logging
+import os
 
 def setup_logging():
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def atomic_write_json(path, data):
+    """Write JSON to a temp file and rename it over `path` so readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def mention(user_id):
+    """Render a user ID as a Discord mention. Queues store IDs; mentions are only built for messages."""
+    return f"<@{user_id}>"
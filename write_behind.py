@@ -0,0 +1,73 @@
+import asyncio
+import contextlib
+import logging
+from metrics import metrics
+
+
+class WriteBehind:
+    """Base for stores that batch their writes and make them from a worker thread.
+
+    Subclasses queue work and call `_schedule_flush()`, and implement:
+    `_take_pending()` to hand over the queued batch (None if there is
+    nothing to write), `_write(batch)` to write it (blocking, runs in a
+    thread), `_requeue(batch)` to put back a batch that failed, and
+    `_has_pending()`. Writes are serialized by an asyncio lock, which
+    subclasses can also hold to keep flushes out of the way.
+    """
+
+    flush_label = None  # `store` label for spanner_flush_seconds, if flushes are timed
+    description = "queued changes"  # What failed, for the error log
+
+    def __init__(self, flush_delay=0.5):
+        self.flush_delay = flush_delay  # Seconds to wait for more changes before writing
+        self._flush_task = None
+        self._lock = None
+
+    async def flush(self):
+        """Write everything queued in a worker thread."""
+        async with self._get_lock():
+            await self._flush_locked()
+
+    def flush_sync(self):
+        """Write everything queued immediately, e.g. on shutdown."""
+        batch = self._take_pending()
+        if batch is not None:
+            self._write(batch)
+
+    async def _flush_locked(self):
+        batch = self._take_pending()
+        if batch is None:
+            return
+        timer = metrics.timer("spanner_flush_seconds", store=self.flush_label) if self.flush_label else contextlib.nullcontext()
+        try:
+            with timer:
+                await asyncio.to_thread(self._write, batch)
+        except Exception:
+            # Put the batch back so the next flush retries it
+            self._requeue(batch)
+            raise
+
+    def _get_lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (startup, scripts, tests): write straight away
+            self.flush_sync()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # Keep draining so changes queued during a write are not left behind
+        while self._has_pending():
+            await asyncio.sleep(self.flush_delay)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Error writing {self.description}: {e}")
+                return